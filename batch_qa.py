@@ -0,0 +1,175 @@
+"""
+Headless question answering over a fixed set of documents, for evaluations and reports.
+
+    python batch_qa.py --docs data/AlMahamid_2022.pdf data/iris_csv.csv --questions questions.txt \
+        --output answers.jsonl --concurrency 8
+
+The questions file has one question per line, or is a .jsonl file of {"id": ..., "question": ...} objects.
+Questions are asked like in the app: the ones tagged with @pdfsearch or @csvsearch are answered by that tool
+directly, the others by the main agent. Each one gets its own conversation, while the pdf index, the csv tables,
+the embedding cache and the answer cache are shared. At most `concurrency` questions run at once. Every answer is
+appended to the output file as soon as it is ready, with its latency and LLM usage; a summary with latency
+percentiles is printed at the end.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.agents import initialize_agent, AgentType
+from langchain.chat_models import AzureChatOpenAI
+from langchain.memory import ConversationBufferWindowMemory
+
+from utilities.agent_tools import PdfSearchTool, CsvToolSearch, arun_agent, get_document_embeddings
+from utilities.answer_cache import AnswerCache
+from utilities.csv_engine import CsvEngine
+from utilities.index_store import IndexStore
+from utilities.ingestion import file_hash, load_csv_file, load_pdf_store, register_csv_file
+from utilities.prompts import CUSTOM_CHATBOT_PREFIX, CUSTOM_CHATBOT_SUFFIX
+from utilities.router import arun_routed
+from utilities.tracing import tracer
+from utilities.tracing_callbacks import TracingCallbackHandler
+
+
+def configure_azure():
+    load_dotenv()
+    os.environ["OPENAI_API_BASE"] = os.environ["AZURE_OPENAI_ENDPOINT"]
+    os.environ["OPENAI_API_VERSION"] = os.environ["AZURE_OPENAI_API_VERSION"]
+    os.environ["OPENAI_API_TYPE"] = "azure"
+    os.environ["OPENAI_API_KEY"] = os.environ["AZURE_OPENAI_API_KEY"]
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    questions = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                questions.append({"id": record.get("id", len(questions)), "question": record["question"]})
+            else:
+                questions.append({"id": len(questions), "question": line})
+    return questions
+
+
+def load_csv_engine(csv_paths: List[str]) -> CsvEngine:
+    engine = CsvEngine()
+    for path in csv_paths:
+        fingerprint = file_hash(path)
+        register_csv_file(engine, os.path.basename(path), load_csv_file(path, fingerprint), fingerprint)
+    return engine
+
+
+def build_tools(llm: AzureChatOpenAI, docs: List[str], embedding_model: str,
+                answer_cache: AnswerCache) -> List[Any]:
+    pdf_paths = [path for path in docs if path.lower().endswith(".pdf")]
+    csv_paths = [path for path in docs if path.lower().endswith(".csv")]
+    unsupported = set(docs) - set(pdf_paths) - set(csv_paths)
+    if unsupported:
+        raise ValueError(f"Unsupported file types: {sorted(unsupported)}")
+
+    tools = []
+    if pdf_paths:
+        store = load_pdf_store(pdf_paths, embedding_model, get_document_embeddings(embedding_model), IndexStore())
+        tools.append(PdfSearchTool(llm=llm, store=store, embedding_model=embedding_model, answer_cache=answer_cache))
+    if csv_paths:
+        tools.append(CsvToolSearch(llm=llm, engine=load_csv_engine(csv_paths), answer_cache=answer_cache))
+    return tools
+
+
+def new_agent(llm: AzureChatOpenAI, tools: List[Any]) -> Any:
+    return initialize_agent(agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+                            tools=tools,
+                            llm=llm,
+                            memory=ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True,
+                                                                  k=10),
+                            agent_kwargs={"system_message": CUSTOM_CHATBOT_PREFIX,
+                                          "human_message": CUSTOM_CHATBOT_SUFFIX},
+                            handle_parsing_errors=True)
+
+
+async def answer_questions(questions: List[Dict[str, Any]], llm: AzureChatOpenAI, tools: List[Any],
+                           answer_cache: AnswerCache, scope: str, output_path: str,
+                           concurrency: int) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def answer(item: Dict[str, Any]):
+        async with semaphore:
+            start = time.perf_counter()
+            error = None
+            with tracer.request("batch_question", question_id=item["id"]) as trace:
+                try:
+                    callbacks = [TracingCallbackHandler()]
+                    answer_text = await arun_routed(item["question"], tools, callbacks=callbacks)
+                    if answer_text is None:
+                        answer_text = await arun_agent(item["question"], new_agent(llm, tools),
+                                                       answer_cache=answer_cache, scope=scope,
+                                                       callbacks=callbacks)
+                except Exception as e:
+                    answer_text, error = None, str(e)
+            result = {**item, "answer": answer_text, "error": error, "latency_s": time.perf_counter() - start,
+                      "llm_calls": trace.llm_calls, "prompt_tokens": trace.prompt_tokens,
+                      "completion_tokens": trace.completion_tokens, "trace_id": trace.trace_id}
+            # answers are written as they come, a crash keeps the ones already done
+            with open(output_path, "a") as f:
+                f.write(json.dumps(result) + "\n")
+            results.append(result)
+
+    await asyncio.gather(*(answer(item) for item in questions))
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], seconds: float, answer_cache: AnswerCache) -> Dict[str, Any]:
+    latencies = [result["latency_s"] for result in results]
+    return {
+        "questions": len(results),
+        "errors": sum(result["error"] is not None for result in results),
+        "seconds": seconds,
+        "questions_per_second": len(results) / seconds if seconds else 0.0,
+        "p50_s": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "p90_s": float(np.percentile(latencies, 90)) if latencies else 0.0,
+        "p99_s": float(np.percentile(latencies, 99)) if latencies else 0.0,
+        "llm_calls": sum(result["llm_calls"] for result in results),
+        "prompt_tokens": sum(result["prompt_tokens"] for result in results),
+        "completion_tokens": sum(result["completion_tokens"] for result in results),
+        "answer_cache": answer_cache.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", nargs="+", required=True, help="pdf and csv files to ask about")
+    parser.add_argument("--questions", required=True, help="text file with one question per line, or .jsonl")
+    parser.add_argument("--output", required=True, help="jsonl file the answers are appended to")
+    parser.add_argument("--model", default="MOSE-GPT4-8k", help="chat model deployment")
+    parser.add_argument("--concurrency", type=int, default=4, help="questions answered at once")
+    parser.add_argument("--answer-cache-threshold", type=float,
+                        default=float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95)))
+    args = parser.parse_args()
+
+    configure_azure()
+    embedding_model = os.environ["EMBEDDING_MODEL"]
+    llm = AzureChatOpenAI(deployment_name=args.model, temperature=0.0)
+    answer_cache = AnswerCache(get_document_embeddings(embedding_model), threshold=args.answer_cache_threshold)
+
+    with tracer.request("batch_ingestion", docs=args.docs):
+        tools = build_tools(llm, args.docs, embedding_model, answer_cache)
+    # same scoping as the app: cached answers are only valid for this model and these documents
+    scope = ":".join([args.model] + [tool.document_fingerprint() for tool in tools])
+
+    questions = read_questions(args.questions)
+    start = time.perf_counter()
+    results = asyncio.run(answer_questions(questions, llm, tools, answer_cache, scope, args.output,
+                                           args.concurrency))
+    print(json.dumps(summarize(results, time.perf_counter() - start, answer_cache), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Before/after comparison of pdf chunking: the former 250-character splitter against token-sized chunks with
+headers, footers and near-duplicates removed.
+
+    python -m benchmarks.chunking_benchmark --pdf data/AlMahamid_2022.pdf --output chunking.json
+
+For both ways of chunking it reports the number of chunks, the tokens sent to the embedding model and the time
+taken. Retrieval quality is compared without embeddings, with the BM25 index the app uses:
+
+- vocabulary_coverage: share of the distinct words of the pdf that are still in some chunk.
+- top_k_recall: for each benchmark question, share of the words of the top k chunks of the former chunking that
+  are in the top k chunks of the new one, i.e. whether the same passages are still found.
+"""
+import json
+import time
+import argparse
+import statistics
+from typing import Any, Dict, List
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.run_benchmark import PDF_PATH, PDF_QUESTIONS
+from utilities.bm25 import BM25Index, tokenize
+from utilities.pdf_processing import get_pdf_text, iter_pdf_chunks
+from utilities.tokens import count_tokens
+
+
+def legacy_chunks(pdf_path: str) -> List[str]:
+    """The chunking used before: 250 characters with 50 of overlap, split on newlines"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=250, chunk_overlap=50, length_function=len, separators=["\n\n", "\n"]
+    )
+    return [chunk for text, _ in get_pdf_text(pdf_path, max_workers=1) for chunk in text_splitter.split_text(text)]
+
+
+def token_chunks(pdf_path: str, stats: Dict[str, int]) -> List[str]:
+    return [doc.page_content for batch in iter_pdf_chunks(pdf_path, max_workers=1, stats=stats) for doc in batch]
+
+
+def measure(name: str, chunk: Any) -> Dict[str, Any]:
+    start = time.perf_counter()
+    chunks = chunk()
+    return {
+        "name": name,
+        "chunks": chunks,
+        "num_chunks": len(chunks),
+        "embedded_tokens": sum(count_tokens(text) for text in chunks),
+        "chunking_s": round(time.perf_counter() - start, 3),
+    }
+
+
+def top_k_words(index: BM25Index, chunks: List[str], question: str, k: int) -> set:
+    return {word for doc_id, _ in index.search(question, k=k) for word in tokenize(chunks[int(doc_id)])}
+
+
+def compare_retrieval(before: List[str], after: List[str], pdf_words: set, k: int) -> Dict[str, Any]:
+    indexes = []
+    for chunks in (before, after):
+        index = BM25Index()
+        index.add([str(i) for i in range(len(chunks))], chunks)
+        indexes.append(index)
+
+    recalls = {}
+    for question in PDF_QUESTIONS:
+        before_words = top_k_words(indexes[0], before, question, k)
+        after_words = top_k_words(indexes[1], after, question, k)
+        recalls[question] = round(len(before_words & after_words) / len(before_words), 3) if before_words else 1.0
+    return {
+        "vocabulary_coverage": {
+            "before": round(len(pdf_words & {w for text in before for w in tokenize(text)}) / len(pdf_words), 4),
+            "after": round(len(pdf_words & {w for text in after for w in tokenize(text)}) / len(pdf_words), 4),
+        },
+        "top_k_recall": {"k": k, "median": statistics.median(recalls.values()), "per_question": recalls},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default=PDF_PATH)
+    parser.add_argument("--k", type=int, default=10, help="chunks retrieved per question, as in the pdf tool")
+    parser.add_argument("--output", help="write the report to this json file")
+    args = parser.parse_args()
+
+    stats = {}
+    before = measure("before", lambda: legacy_chunks(args.pdf))
+    after = measure("after", lambda: token_chunks(args.pdf, stats))
+    pdf_words = {word for text, _ in get_pdf_text(args.pdf, max_workers=1) for word in tokenize(text)}
+
+    results = {
+        "pdf": args.pdf,
+        "before": {key: value for key, value in before.items() if key not in ("name", "chunks")},
+        "after": {**{key: value for key, value in after.items() if key not in ("name", "chunks")}, **stats},
+        "reduction": {
+            "chunks": round(1 - after["num_chunks"] / max(before["num_chunks"], 1), 3),
+            "embedded_tokens": round(1 - after["embedded_tokens"] / max(before["embedded_tokens"], 1), 3),
+        },
+        "retrieval": compare_retrieval(before["chunks"], after["chunks"], pdf_words, args.k),
+    }
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Deterministic stand-ins for the Azure OpenAI chat and embedding models, with configurable latency."""
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain.chat_models import AzureChatOpenAI
+from langchain.embeddings.base import Embeddings
+from langchain.schema import ChatGeneration, ChatResult
+from langchain.schema.messages import AIMessage, BaseMessage
+
+
+_counter_lock = threading.Lock()
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors, so texts sharing words are similar. Every request sleeps `latency` seconds."""
+
+    def __init__(self, size: int = 256, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.requests = 0
+        self.texts = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with _counter_lock:
+            self.requests += 1
+            self.texts += len(texts)
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _clip(text: str, limit: int = 300) -> str:
+    return " ".join(text.split())[:limit]
+
+
+def fake_reply(prompt: str) -> str:
+    """
+    Reply of a well-behaved model for the agents of this app: the conversational agent (json blobs), the
+    ZERO_SHOT pdf and sql agents (Action/Final Answer) and plain chains (text).
+    """
+    if '"action_input"' in prompt:
+        if "TOOL RESPONSE:" in prompt:
+            observation = prompt.rsplit("TOOL RESPONSE:", 1)[1].split("USER'S INPUT")[0].strip(" -\n")
+            return json.dumps({"action": "Final Answer", "action_input": _clip(observation) or "No results."})
+        question = prompt.strip().splitlines()[-1]
+        for tool_name in ("@pdfsearch", "@csvsearch"):
+            if tool_name in question:
+                return json.dumps({"action": tool_name, "action_input": question})
+        return json.dumps({"action": "Final Answer", "action_input": "Hello! How can I help you?"})
+
+    if "Action Input:" in prompt and "Question: " in prompt:
+        scratchpad = prompt.rsplit("Question: ", 1)[1]
+        question = scratchpad.splitlines()[0]
+        if "Observation:" in scratchpad:
+            observation = scratchpad.rsplit("Observation:", 1)[1].split("Thought:")[0]
+            return f"Thought: I now know the final answer\nFinal Answer: {_clip(observation) or 'No results.'}"
+        if "sql_db_query" in prompt:
+            table = re.search(r'Table "(\w+)"', prompt)
+            return "Thought: I should count the rows\nAction: sql_db_query\n" \
+                   f'Action Input: SELECT COUNT(*) FROM "{table.group(1) if table else "t"}"'
+        search_query = re.sub(r"@\w+,?", "", question).strip()
+        return f"Thought: I should search the documents\nAction: search_given_document\nAction Input: {search_query}"
+
+    return "This is a summary of the conversation."
+
+
+class FakeAzureChatOpenAI(AzureChatOpenAI):
+    """AzureChatOpenAI that never calls Azure: replies come from fake_reply after sleeping `latency` seconds"""
+
+    latency: float = 0.0
+    calls: int = 0
+    prompt_chars: int = 0
+
+    def __init__(self, **kwargs: Any):
+        kwargs.setdefault("deployment_name", "fake-gpt")
+        kwargs.setdefault("openai_api_key", "fake")
+        kwargs.setdefault("openai_api_base", "http://localhost")
+        kwargs.setdefault("openai_api_version", "2023-08-01-preview")
+        super().__init__(**kwargs)
+
+    def _reply(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        with _counter_lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+        text = fake_reply(prompt)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))],
+                          llm_output={"token_usage": {"prompt_tokens": len(prompt) // 4,
+                                                      "completion_tokens": len(text) // 4,
+                                                      "total_tokens": (len(prompt) + len(text)) // 4},
+                                      "model_name": self.deployment_name})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._reply(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._reply(messages)
@@ -0,0 +1,250 @@
+"""
+Offline benchmark of ingestion and question answering, with fake chat and embedding models.
+
+    python -m benchmarks.run_benchmark --scale 10 --llm-latency 0.5 --embedding-latency 0.2 --output bench.json
+
+Reports ingestion throughput, per-query latency percentiles, LLM calls per query and peak memory for the pdf
+tool, the csv tool and the main agent, sync and async, over data/AlMahamid_2022.pdf and data/iris_csv.csv, with the corpora
+replicated `scale` times (pdf) and `csv_scale` times (csv) to simulate larger uploads.
+"""
+import os
+import json
+import asyncio
+import time
+import argparse
+import resource
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from langchain.agents import initialize_agent, AgentType
+from langchain.schema import Document
+
+from benchmarks.fakes import FakeAzureChatOpenAI, FakeEmbeddings
+from utilities.agent_tools import PdfSearchTool, CsvToolSearch, run_agent, arun_agent
+from utilities.budget_memory import TokenBudgetMemory
+from utilities.context_compression import DEFAULT_CONTEXT_TOKENS
+from utilities.csv_engine import CsvEngine
+from utilities.csv_loader import load_csv
+from utilities.csv_profile import profile_dataframe
+from utilities.document_store import DocumentStore
+from utilities.embedding_scheduler import EmbeddingScheduler, ScheduledEmbeddings
+from utilities.pdf_processing import prepare_pdf_chunks
+from utilities.prompts import CUSTOM_CHATBOT_PREFIX, CUSTOM_CHATBOT_SUFFIX
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+PDF_PATH = os.path.join(DATA_DIR, "AlMahamid_2022.pdf")
+CSV_PATH = os.path.join(DATA_DIR, "iris_csv.csv")
+
+PDF_QUESTIONS = [
+    "What is reinforcement learning?",
+    "Which algorithms are compared in the survey?",
+    "What is the difference between value-based and policy-based methods?",
+    "What are the limitations of deep Q-networks?",
+    "How is the exploration-exploitation trade-off handled?",
+    "What environments are used for evaluation?",
+    "What does the paper say about actor-critic methods?",
+    "Who are the authors of the paper?",
+]
+
+CSV_QUESTIONS = [
+    "How many rows are there?",
+    "What is the average sepal length per class?",
+    "Which class has the largest petal width?",
+    "What is the maximum sepal width?",
+]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "queries": len(latencies),
+        "p50_s": float(np.percentile(latencies, 50)),
+        "p90_s": float(np.percentile(latencies, 90)),
+        "p99_s": float(np.percentile(latencies, 99)),
+        "mean_s": float(np.mean(latencies)),
+    }
+
+
+def run_queries(run: Callable[[str], Any], questions: List[str], llm: FakeAzureChatOpenAI) -> Dict[str, float]:
+    latencies = []
+    calls_before = llm.calls
+    for question in questions:
+        start = time.perf_counter()
+        run(question)
+        latencies.append(time.perf_counter() - start)
+    return {**latency_stats(latencies), "llm_calls_per_query": (llm.calls - calls_before) / len(questions)}
+
+
+async def arun_tool_pairs(pdf_tool: PdfSearchTool, csv_tool: CsvToolSearch, pdf_questions: List[str],
+                          csv_questions: List[str], llm: FakeAzureChatOpenAI) -> Dict[str, float]:
+    """Asks each pdf question together with a csv question, both tools run concurrently on the event loop"""
+    latencies = []
+    calls_before = llm.calls
+    for pdf_question, csv_question in zip(pdf_questions, csv_questions * len(pdf_questions)):
+        start = time.perf_counter()
+        await asyncio.gather(pdf_tool.arun(pdf_question), csv_tool.arun(csv_question))
+        latencies.append(time.perf_counter() - start)
+    return {**latency_stats(latencies), "llm_calls_per_query": (llm.calls - calls_before) / len(pdf_questions)}
+
+
+async def arun_concurrent_agents(agents: List[Any], questions: List[str],
+                                 llm: FakeAzureChatOpenAI) -> Dict[str, float]:
+    """Asks all questions at once, each agent answers its share of them one after the other"""
+    async def ask(agent, agent_questions):
+        latencies = []
+        for question in agent_questions:
+            start = time.perf_counter()
+            await arun_agent(question, agent)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    calls_before = llm.calls
+    start = time.perf_counter()
+    shares = await asyncio.gather(*(ask(agent, questions[i::len(agents)]) for i, agent in enumerate(agents)))
+    seconds = time.perf_counter() - start
+    return {**latency_stats([latency for share in shares for latency in share]),
+            "llm_calls_per_query": (llm.calls - calls_before) / len(questions),
+            "seconds": seconds, "queries_per_second": len(questions) / seconds if seconds else 0.0}
+
+
+def replicate_chunks(chunks: List[Document], scale: int) -> Dict[str, List[Document]]:
+    """Copies of the corpus as separate sources, with the copy number in the text so every chunk is distinct"""
+    sources = {}
+    for copy in range(scale):
+        source = f"copy_{copy}"
+        sources[source] = [Document(page_content=f"{chunk.page_content} [{copy}]",
+                                    metadata={**chunk.metadata, "source": f"{source}.pdf"})
+                           for chunk in chunks]
+    return sources
+
+
+def bench_pdf_ingestion(scale: int, embeddings: FakeEmbeddings, batch_size: int,
+                        max_concurrency: int) -> Tuple[DocumentStore, Dict[str, float]]:
+    start = time.perf_counter()
+    chunking = {}
+    chunks = prepare_pdf_chunks([PDF_PATH], stats=chunking)
+    parse_seconds = time.perf_counter() - start
+
+    scheduler = EmbeddingScheduler(embeddings.embed_documents, batch_size=batch_size, max_concurrency=max_concurrency)
+    store = DocumentStore(ScheduledEmbeddings(embeddings, scheduler))
+    start = time.perf_counter()
+    for source, documents in replicate_chunks(chunks, scale).items():
+        store.add(source, documents, name=f"{source}.pdf")
+    index_seconds = time.perf_counter() - start
+
+    num_chunks = len(chunks) * scale
+    return store, {
+        "chunks_per_copy": len(chunks),
+        # pages, tokens embedded and text removed before embedding, per copy
+        "chunking": chunking,
+        "chunks": num_chunks,
+        "parse_seconds": parse_seconds,
+        "index_seconds": index_seconds,
+        "index_chunks_per_second": num_chunks / index_seconds if index_seconds else 0.0,
+        "embedding_requests": embeddings.requests,
+    }
+
+
+def bench_csv_ingestion(csv_scale: int) -> Tuple[CsvEngine, Dict[str, float]]:
+    engine = CsvEngine()
+    start = time.perf_counter()
+    df, report = load_csv(CSV_PATH)
+    engine.register("iris.csv", df, profile=profile_dataframe(df))
+    if csv_scale > 1:
+        large_df = pd.concat([df] * csv_scale, ignore_index=True)
+        engine.register("iris_large.csv", large_df, profile=profile_dataframe(large_df))
+    seconds = time.perf_counter() - start
+    return engine, {"rows": len(df) * max(csv_scale, 1), "seconds": seconds, "iris_memory": report}
+
+
+def measure(name: str, results: Dict[str, Any], use_tracemalloc: bool, fn: Callable[[], Any]) -> Any:
+    if use_tracemalloc:
+        tracemalloc.start()
+    output, stats = fn()
+    if use_tracemalloc:
+        stats["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    stats["process_peak_rss_mb"] = peak_rss_mb()
+    results[name] = stats
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="copies of the pdf corpus")
+    parser.add_argument("--csv-scale", type=int, default=1000, help="copies of the iris rows in the large table")
+    parser.add_argument("--repeat", type=int, default=1, help="times each question is asked")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake chat model call")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="seconds per fake embedding request")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--memory-token-limit", type=int, default=1500)
+    parser.add_argument("--concurrency", type=int, default=4, help="conversations asking at once in the async phase")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="tokens of retrieved text per pdf search, 0 to hand the chunks whole to the pdf agent")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report python heap peaks, slower")
+    parser.add_argument("--output", help="write the report to this json file")
+    args = parser.parse_args()
+
+    llm = FakeAzureChatOpenAI(latency=args.llm_latency)
+    embeddings = FakeEmbeddings(latency=args.embedding_latency)
+    results = {"settings": vars(args)}
+
+    store = measure("pdf_ingestion", results, args.tracemalloc,
+                    lambda: bench_pdf_ingestion(args.scale, embeddings, args.batch_size, args.max_concurrency))
+    engine = measure("csv_ingestion", results, args.tracemalloc, lambda: bench_csv_ingestion(args.csv_scale))
+
+    pdf_tool = PdfSearchTool(llm=llm, store=store, context_tokens=args.context_tokens)
+    csv_tool = CsvToolSearch(llm=llm, engine=engine)
+    pdf_questions = PDF_QUESTIONS * args.repeat
+    csv_questions = CSV_QUESTIONS * args.repeat
+
+    measure("pdf_tool", results, args.tracemalloc,
+            lambda: (None, run_queries(pdf_tool.run, pdf_questions, llm)))
+    results["pdf_tool"]["context"] = pdf_tool.context_stats()
+    measure("csv_tool", results, args.tracemalloc,
+            lambda: (None, run_queries(csv_tool.run, csv_questions, llm)))
+
+    # the tools cache nothing here, so the async phases repeat the same work as the sync ones
+    measure("arun_tool_pairs", results, args.tracemalloc,
+            lambda: (None, asyncio.run(arun_tool_pairs(pdf_tool, csv_tool, pdf_questions, csv_questions, llm))))
+
+    def new_agent():
+        return initialize_agent(agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+                                tools=[pdf_tool, csv_tool],
+                                llm=llm,
+                                memory=TokenBudgetMemory(llm=llm, max_token_limit=args.memory_token_limit),
+                                agent_kwargs={"system_message": CUSTOM_CHATBOT_PREFIX,
+                                              "human_message": CUSTOM_CHATBOT_SUFFIX},
+                                handle_parsing_errors=True)
+
+    agent = new_agent()
+    agent_questions = [f"@pdfsearch, {question}" for question in pdf_questions] + \
+                      [f"@csvsearch, {question}" for question in csv_questions]
+    measure("run_agent", results, args.tracemalloc,
+            lambda: (None, run_queries(lambda question: run_agent(question, agent), agent_questions, llm)))
+    results["run_agent"]["memory"] = agent.memory.stats()
+    # one conversation per concurrent user, they share the tools and the model
+    agents = [new_agent() for _ in range(args.concurrency)]
+    measure("arun_agent_concurrent", results, args.tracemalloc,
+            lambda: (None, asyncio.run(arun_concurrent_agents(agents, agent_questions, llm))))
+
+    results["totals"] = {"llm_calls": llm.calls, "llm_prompt_chars": llm.prompt_chars,
+                         "embedding_requests": embeddings.requests, "embedded_texts": embeddings.texts}
+
+    report = json.dumps(results, indent=2, default=str)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
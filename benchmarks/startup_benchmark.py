@@ -0,0 +1,161 @@
+"""
+Startup benchmark of the app: import times, cold start and rerun overhead before any document is uploaded.
+
+    python -m benchmarks.startup_benchmark --runs 5 --output startup.json
+
+Each measurement runs in a fresh interpreter with `python -X importtime`, so nothing is imported yet:
+
+- modules: import time of each module of the app, with its heaviest imports.
+- app: the app script run once like on a first page load (cold start), then again like on a Streamlit rerun,
+  in the same interpreter. Also lists the heavy dependencies the app imported before a document is uploaded,
+  there should be none, apart from those streamlit itself imports (pandas, numpy, pyarrow), listed separately.
+
+The app runs without `streamlit run`: like the Streamlit server, the interpreter imports streamlit first, then
+runs the script in a script run context with a session state kept between the two runs. Placeholder Azure settings
+are used, no request is sent.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Any, Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT_DIR, "multi_agent_app.py")
+
+MODULES = [
+    "utilities.prompts",
+    "utilities.tracing",
+    "utilities.corpus_registry",
+    "utilities.router",
+    "utilities.streaming",
+    "utilities.budget_memory",
+    "utilities.agent_tools",
+    "utilities.document_store",
+    "utilities.pdf_processing",
+    "utilities.csv_engine",
+    "utilities.csv_loader",
+]
+
+# dependencies that should only be imported once a pdf or csv tool is needed
+HEAVY_MODULES = ["pandas", "duckdb", "pyarrow", "faiss", "numpy", "PyPDF2", "langchain", "langchain_experimental",
+                 "tiktoken", "openai", "langchain.agents", "langchain.chat_models"]
+
+PLACEHOLDER_ENV = {
+    "AZURE_OPENAI_API_KEY": "placeholder",
+    "AZURE_OPENAI_ENDPOINT": "http://localhost",
+    "AZURE_OPENAI_API_VERSION": "2023-08-01-preview",
+    "EMBEDDING_MODEL": "embedding",
+    "TRACE_FILE": "",
+}
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+APP_RUNS_CODE = """
+import json, runpy, sys, threading, time, warnings, logging
+warnings.simplefilter("ignore")
+logging.disable(logging.WARNING)
+import streamlit
+import streamlit_chat
+from streamlit.runtime.memory_uploaded_file_manager import MemoryUploadedFileManager
+from streamlit.runtime.scriptrunner import ScriptRunContext, add_script_run_ctx
+from streamlit.runtime.state import SafeSessionState, SessionState
+loaded_by_streamlit = [name for name in {heavy!r} if name in sys.modules]
+ctx = ScriptRunContext(session_id="benchmark", _enqueue=lambda msg: None, query_string="",
+                       session_state=SafeSessionState(SessionState()),
+                       uploaded_file_mgr=MemoryUploadedFileManager("/benchmark"), page_script_hash="",
+                       user_info={{"email": "benchmark"}})
+add_script_run_ctx(threading.current_thread(), ctx)
+timings = []
+for _ in range(2):
+    ctx.reset()
+    start = time.perf_counter()
+    runpy.run_path({app_path!r}, run_name="__main__")
+    timings.append(time.perf_counter() - start)
+loaded = [name for name in {heavy!r} if name in sys.modules and name not in loaded_by_streamlit]
+print(json.dumps({{"cold_start_s": timings[0], "rerun_s": timings[1], "heavy_modules_loaded": loaded,
+                  "loaded_by_streamlit": loaded_by_streamlit}}))
+"""
+
+
+def parse_importtime(stderr: str, top: int = 10) -> Dict[str, Any]:
+    """
+    Total import time and the heaviest imports from the `-X importtime` output, at any depth: a heavy dependency
+    imported by a module of the app shows with its own cumulative time, not only within the app module's.
+    """
+    total = 0
+    imports = {}
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            seconds = int(match.group(2)) / 1e6
+            imports[match.group(4)] = seconds
+            if not match.group(3):
+                # nested imports are already in the cumulative time of their top-level import
+                total += seconds
+    heaviest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {"import_s": total, "heaviest": {name: round(seconds, 4) for name, seconds in heaviest}}
+
+
+def run_python(args: List[str]) -> subprocess.CompletedProcess:
+    python_path = os.environ.get("PYTHONPATH")
+    env = {**os.environ, **PLACEHOLDER_ENV,
+           "PYTHONPATH": ROOT_DIR + os.pathsep + python_path if python_path else ROOT_DIR}
+    return subprocess.run([sys.executable, "-X", "importtime", *args], cwd=ROOT_DIR, env=env,
+                          capture_output=True, text=True)
+
+
+def bench_module(module: str, runs: int) -> Dict[str, Any]:
+    results = []
+    for _ in range(runs):
+        process = run_python(["-c", f"import {module}"])
+        if process.returncode != 0:
+            return {"error": process.stderr.strip().splitlines()[-1]}
+        results.append(parse_importtime(process.stderr))
+    return {"import_s": statistics.median(result["import_s"] for result in results),
+            "heaviest": results[-1]["heaviest"]}
+
+
+def bench_app(runs: int) -> Dict[str, Any]:
+    results = []
+    for _ in range(runs):
+        process = run_python(["-c", APP_RUNS_CODE.format(app_path=APP_PATH, heavy=HEAVY_MODULES)])
+        if process.returncode != 0:
+            return {"error": process.stderr.strip().splitlines()[-1]}
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result.update(parse_importtime(process.stderr))
+        results.append(result)
+    return {
+        "cold_start_s": statistics.median(result["cold_start_s"] for result in results),
+        "rerun_s": statistics.median(result["rerun_s"] for result in results),
+        "import_s": statistics.median(result["import_s"] for result in results),
+        "heavy_modules_loaded": results[-1]["heavy_modules_loaded"],
+        "loaded_by_streamlit": results[-1]["loaded_by_streamlit"],
+        "heaviest": results[-1]["heaviest"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per measurement, medians are reported")
+    parser.add_argument("--output", help="write the report to this json file")
+    args = parser.parse_args()
+
+    results = {
+        "python": sys.version.split()[0],
+        "app": bench_app(args.runs),
+        "modules": {module: bench_module(module, args.runs) for module in MODULES},
+    }
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,151 @@
 import os
 
-import pandas as pd
 import streamlit as st
 from streamlit_chat import message
-from PyPDF2 import PdfReader
 from dotenv import load_dotenv
 
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chat_models import AzureChatOpenAI
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.agents import initialize_agent, AgentType
-
-from utilities.agent_tools import PdfSearchTool, CsvToolSearch, run_agent
+from utilities.corpus_registry import CorpusRegistry
+from utilities.tracing import tracer
 from utilities.prompts import CUSTOM_CHATBOT_PREFIX, CUSTOM_CHATBOT_SUFFIX,WELCOME_MESSAGE
 
+# Heavy dependencies (pandas, DuckDB, FAISS, PyPDF2, the langchain agents and chat models) are imported inside
+# the functions that need them, so the page is interactive before any document is uploaded.
+# See benchmarks/startup_benchmark.py.
+
+
+def nearest_pdf_store(file_hashes):
+    """
+    The shared pdf index with the most of these files and, among those, the fewest other files. Usually the one
+    the session used before a file was added or removed.
+    """
+    best, best_score = None, (0, 0)
+    for _, store in get_corpus_registry().corpora(prefix=f"pdf:{EMBEDDING_MODEL}:"):
+        sources = set(store.sources)
+        score = (len(sources & file_hashes), -len(sources - file_hashes))
+        if score[0] and score > best_score:
+            best, best_score = store, score
+    return best
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm(model):
+    from langchain.chat_models import AzureChatOpenAI
+
+    # streaming lets the final answer be shown token by token, see StreamlitStreamHandler
+    return AzureChatOpenAI(deployment_name=model, temperature=0.0, streaming=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    """
+    Shared by all sessions, answers are scoped to the model and the documents they were given for, and the main
+    agent's answers also to the conversation so far (see conversation_scope).
+    """
+    from utilities.agent_tools import get_document_embeddings
+    from utilities.answer_cache import AnswerCache
+
+    embeddings = get_document_embeddings(EMBEDDING_MODEL, **EMBEDDING_SCHEDULER_SETTINGS)
+    return AnswerCache(embeddings, threshold=ANSWER_CACHE_THRESHOLD)
+
+
+@st.cache_resource(show_spinner=False)
+def get_index_store():
+    from utilities.index_store import IndexStore
+
+    # the folders of the pdf indexes that sessions still hold are not pruned
+    return IndexStore(in_use=lambda: [store.fingerprint for _, store in get_corpus_registry().corpora("pdf:")])
+
+
+@st.cache_resource(show_spinner=False)
+def get_corpus_registry():
+    return CorpusRegistry()
+
+
+def get_pdf_store(pdf_docs):
+    """
+    Returns the index of the pdf files, shared with the other sessions that uploaded the same files. The session
+    holds a handle to it until its files change.
+    """
+    from utilities.agent_tools import get_document_embeddings
+    from utilities.document_store import DocumentStore
+    from utilities.ingestion import file_hash, load_pdf_store
+
+    fingerprint = DocumentStore.fingerprint_of(file_hash(document) for document in pdf_docs)
+    key = f"pdf:{EMBEDDING_MODEL}:{fingerprint}"
+    handle = st.session_state.get("pdf_handle")
+    if handle is not None and handle.key == key:
+        return handle.corpus
+
+    embeddings = get_document_embeddings(EMBEDDING_MODEL, **EMBEDDING_SCHEDULER_SETTINGS)
+
+    def build():
+        # derived from the nearest shared index when there is no saved one, see load_pdf_store
+        store = load_pdf_store(pdf_docs, EMBEDDING_MODEL, embeddings, get_index_store(), nearest_pdf_store)
+        # the store is shared by every session with the same files
+        store.read_only = True
+        return store
+
+    new_handle = get_corpus_registry().acquire(key, build)
+    if handle is not None:
+        handle.release()
+    st.session_state["pdf_handle"] = new_handle
+    return new_handle.corpus
+
 
-def get_pdf_text(pdf_doc):
-    text = ""
-    metadata = {}
-    pdf_reader = PdfReader(pdf_doc)
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    metadata['source'] = pdf_doc
-    return text, metadata
+def release_csv_file(file_name):
+    """Drops a csv file from the session, its table is evicted when no other session uses it"""
+    index = st.session_state["csv_files"]["name"].index(file_name)
+    table_name = st.session_state["csv_files"]["table"][index]
+    for values in st.session_state["csv_files"].values():
+        del values[index]
+    get_csv_engine().unregister(table_name)
+    st.session_state["csv_handles"].pop(file_name).release()
 
 
-def get_document_chunks(text, metadata):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=250, chunk_overlap=50, length_function=len, separators=["\n\n", "\n"]
-    )
-    chunks = text_splitter.split_text(text)
-    docs=[]
-    for chunk in chunks:
-        # Generate documents
-        docs.append(Document(page_content=chunk, metadata=metadata))
-    return docs
+def get_csv_engine():
+    """The session's DuckDB database of csv tables, created with the first csv file"""
+    if "csv_engine" not in st.session_state:
+        from utilities.csv_engine import CsvEngine
 
+        st.session_state["csv_engine"] = CsvEngine()
+    return st.session_state["csv_engine"]
 
-def prepare_pdf_chunks(pdf_docs):
-    doc_chunks = []
-    for document in pdf_docs:
-        # get pdf text
-        raw_text, metadata = get_pdf_text(document)
-        # get the text chunks
-        doc_chunks.append(get_document_chunks(raw_text, metadata))
 
-    doc_chunks = [item for sublist in doc_chunks for item in sublist]
-    return doc_chunks
+def release_corpora():
+    """Releases the session's handles to the shared pdf index and csv tables"""
+    if "pdf_handle" in st.session_state:
+        st.session_state.pop("pdf_handle").release()
+    for handle in st.session_state.pop("csv_handles", {}).values():
+        handle.release()
+
+
+def build_tools(llm):
+    """
+    Builds the tools for the uploaded files. The pdf index and csv tables are shared with other sessions that
+    uploaded the same files, the tools only read them.
+    """
+    from utilities.agent_tools import PdfSearchTool, CsvToolSearch
+
+    tools = []
+
+    if st.session_state["pdf_files"]:
+        st.session_state["pdf_store"] = get_pdf_store(st.session_state["pdf_files"])
+        doc_tool = PdfSearchTool(llm=llm, store=st.session_state["pdf_store"], embedding_model=EMBEDDING_MODEL,
+                                 answer_cache=get_answer_cache(), context_tokens=PDF_CONTEXT_TOKENS)
+        tools.append(doc_tool)
+    elif "pdf_handle" in st.session_state:
+        st.session_state.pop("pdf_handle").release()
+        st.session_state.pop("pdf_store", None)
+
+    if st.session_state["csv_files"]["name"]:
+        # all csv files are tables of one DuckDB database, the agent answers with sql queries
+        csv_tool = CsvToolSearch(llm=llm, engine=get_csv_engine(), answer_cache=get_answer_cache())
+        tools.append(csv_tool)
+
+    # cached answers of the main agent are only valid for this model and these documents
+    st.session_state["answer_scope"] = ":".join([MODEL] + [tool.document_fingerprint() for tool in tools])
+
+    return tools
 
 
 def get_file_type(uploaded_file):
@@ -96,18 +194,33 @@ def reset_agent_chain(delete_files=False):
             pass
 
     if delete_files:
+        st.session_state["tools_stale"] = 1
+        release_corpora()
+
         if "pdf_files" in st.session_state:
             try:
                 del st.session_state["pdf_files"]
             except NameError:
                 pass
 
+        if "pdf_store" in st.session_state:
+            try:
+                del st.session_state["pdf_store"]
+            except NameError:
+                pass
+
         if "csv_files" in st.session_state:
             try:
                 del st.session_state["csv_files"]
             except NameError:
                 pass
 
+        if "csv_engine" in st.session_state:
+            try:
+                del st.session_state["csv_engine"]
+            except NameError:
+                pass
+
 
 load_dotenv()
 
@@ -115,6 +228,18 @@ os.environ["OPENAI_API_BASE"] = os.environ["AZURE_OPENAI_ENDPOINT"]
 os.environ["OPENAI_API_VERSION"] = os.environ["AZURE_OPENAI_API_VERSION"]
 os.environ["OPENAI_API_TYPE"] = "azure"
 EMBEDDING_MODEL = os.environ["EMBEDDING_MODEL"]
+# optional settings for batching and rate limiting the embedding requests
+EMBEDDING_SCHEDULER_SETTINGS = {
+    "batch_size": int(os.environ.get("EMBEDDING_BATCH_SIZE", 16)),
+    "max_concurrency": int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 4)),
+    "requests_per_minute": float(os.environ.get("EMBEDDING_REQUESTS_PER_MINUTE", 0)) or None,
+    "tokens_per_minute": float(os.environ.get("EMBEDDING_TOKENS_PER_MINUTE", 0)) or None,
+}
+# cosine similarity above which two questions are considered the same by the answer cache
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+# tokens of conversation history sent with every question, older turns are summarized to stay under it
+MEMORY_TOKEN_LIMIT = int(os.environ.get("MEMORY_TOKEN_LIMIT", 1500))
+PDF_CONTEXT_TOKENS = int(os.environ.get("PDF_CONTEXT_TOKENS", 800))
 try:
     os.environ["OPENAI_API_KEY"] = os.environ["AZURE_OPENAI_API_KEY"]
     API_O = True
@@ -128,6 +253,7 @@ st.set_page_config(page_title='Chat with your documents', layout='wide')
 with st.sidebar.expander("Model settings", expanded=True):
     MODEL = st.selectbox(label='Model',
                          options=["MOSE-GPT4-8k", "MOSE-GPT4-32k"])
+    SHOW_TRACES = st.checkbox("Show request traces", value=False)
 
 uploaded_file = st.sidebar.file_uploader(
     "Upload your pdf or csv documents here. Click on 'Add Data'", accept_multiple_files=True
@@ -143,6 +269,12 @@ if "csv_files" not in st.session_state:
     st.session_state["csv_files"] = {}
     st.session_state["csv_files"]["name"] = []
     st.session_state["csv_files"]["df"] = []
+    st.session_state["csv_files"]["report"] = []
+    # name of each file's table in the session's CsvEngine, it differs from the file name
+    st.session_state["csv_files"]["table"] = []
+
+if "csv_handles" not in st.session_state:
+    st.session_state["csv_handles"] = {}
 
 
 # Ask the user to enter their OpenAI API key
@@ -150,43 +282,93 @@ if not API_O:
     API_O = st.sidebar.text_input("API-KEY", type="password")
     os.environ["OPENAI_API_KEY"] = API_O
 
+# drop files that were removed from the uploader, the session releases their shared index and tables. This also
+# runs when the uploader was cleared, the tools are then not rebuilt and would otherwise hold them until the
+# session ends.
+kept_pdf_files = [file for file in st.session_state["pdf_files"] if file in (uploaded_file or [])]
+if len(kept_pdf_files) != len(st.session_state["pdf_files"]):
+    st.session_state["pdf_files"] = kept_pdf_files
+    st.session_state["tools_stale"] = 1
+uploaded_names = {file.name for file in uploaded_file or []}
+for file_name in list(st.session_state["csv_files"]["name"]):
+    if file_name not in uploaded_names:
+        release_csv_file(file_name)
+        st.session_state["tools_stale"] = 1
+if not uploaded_file:
+    if "pdf_handle" in st.session_state:
+        st.session_state.pop("pdf_handle").release()
+    st.session_state.pop("pdf_store", None)
+    st.session_state.pop("tools", None)
+    st.session_state.pop("agent_chain", None)
+
 if uploaded_file:
     for file in uploaded_file:
         file_type = get_file_type(file)
         if "pdf" in file_type:
             if file not in st.session_state["pdf_files"]:
                 st.session_state["pdf_files"].append(file)
-                st.session_state["update_tools"] = 1
+                st.session_state["tools_stale"] = 1
         elif "csv" in file_type:
             # adding directly csv files to the csv_files session state causes error while reading it into dataframe
             # This is a workaround:
             if file.name not in st.session_state["csv_files"]["name"]:
-                df = pd.read_csv(file)
+                from utilities.ingestion import file_hash, load_csv_file, register_csv_file
+
+                fingerprint = file_hash(file)
+                # loaded once per content hash, the table and its profile are shared by the sessions with the file
+                handle = get_corpus_registry().acquire(f"csv:{fingerprint}",
+                                                       lambda: load_csv_file(file, fingerprint))
+                st.session_state["csv_handles"][file.name] = handle
+                df, report, _, _ = handle.corpus
+                table_name = register_csv_file(get_csv_engine(), file.name, handle.corpus, fingerprint)
+                st.session_state["csv_files"]["table"].append(table_name)
                 st.session_state["csv_files"]["df"].append(df)
                 st.session_state["csv_files"]["name"].append(file.name)
-                st.session_state["update_tools"] = 1
+                st.session_state["csv_files"]["report"].append(report)
+                st.session_state["tools_stale"] = 1
         else:
             print("Unsupported file type.")
 
     if API_O:
-        llm = AzureChatOpenAI(deployment_name=MODEL, temperature=0.0)
-        tools = []
-
-        if st.session_state["pdf_files"]:
-            # get chunks from pdf docs
-            doc_chunks = prepare_pdf_chunks(st.session_state["pdf_files"])
-            doc_tool = PdfSearchTool(llm=llm, doc_chunks=doc_chunks, embedding_model=EMBEDDING_MODEL)
-            tools.append(doc_tool)
+        llm = get_llm(MODEL)
+
+        # reruns triggered by widgets or chat messages reuse the tools, they are rebuilt only for new files or models
+        if st.session_state.get("tools_stale", 1) or st.session_state.get("tools_model") != MODEL \
+                or "tools" not in st.session_state:
+            # spans of the parsing, chunking and embedding of new files are exported with this request
+            with tracer.request("build_tools", model=MODEL) as trace:
+                st.session_state["tools"] = build_tools(llm)
+            st.session_state["build_tools_trace"] = trace.summary()
+            st.session_state["tools_model"] = MODEL
+            st.session_state["tools_stale"] = 0
+            st.session_state["update_tools"] = 1
+        tools = st.session_state["tools"]
+
+        if "pdf_store" in st.session_state:
+            with st.sidebar.expander("Embeddings", expanded=False):
+                embeddings = st.session_state["pdf_store"].embeddings
+                st.write({"cache": embeddings.stats(), "requests": embeddings.embeddings.scheduler.stats()})
+            pdf_tools = [tool for tool in tools if tool.name == "@pdfsearch"]
+            if pdf_tools:
+                with st.sidebar.expander("PDF context", expanded=False):
+                    st.write(pdf_tools[0].context_stats())
 
         if st.session_state["csv_files"]["name"]:
-            # TODO: what happens with multiple csv files?
-            csv_file = st.session_state["csv_files"]["name"][0]
-            csv_tool = CsvToolSearch(llm=llm, df=st.session_state["csv_files"]["df"][0])
-            tools.append(csv_tool)
+            with st.sidebar.expander("CSV memory", expanded=False):
+                st.write(dict(zip(st.session_state["csv_files"]["name"], st.session_state["csv_files"]["report"])))
+
+        with st.sidebar.expander("Answer cache", expanded=False):
+            st.write(get_answer_cache().stats())
+
+        with st.sidebar.expander("Shared documents", expanded=False):
+            st.write(get_corpus_registry().stats())
 
         # set up chat memory
         if 'memory' not in st.session_state:
-            memory = ConversationBufferWindowMemory(memory_key="chat_history", return_messages=True, k=10)
+            from utilities.budget_memory import TokenBudgetMemory
+
+            memory = TokenBudgetMemory(llm=llm, memory_key="chat_history", return_messages=True,
+                                       max_token_limit=MEMORY_TOKEN_LIMIT)
             st.session_state.memory = memory
 
     else:
@@ -196,7 +378,11 @@ if uploaded_file:
     st.sidebar.button("New Chat", on_click=new_chat, type='primary')
 
 
-    def conversational_chat(query):
+    def conversational_chat(query, callbacks=None):
+        from langchain.agents import initialize_agent, AgentType
+        from utilities.agent_tools import run_agent
+        from utilities.router import run_routed
+
         if ("agent_chain" not in st.session_state) or st.session_state["update_tools"]:
             # create final agent with tools
             final_agent = initialize_agent(agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
@@ -211,7 +397,12 @@ if uploaded_file:
 
             st.session_state["agent_chain"] = final_agent
 
-        result = run_agent(query, st.session_state["agent_chain"])
+        # questions tagged with one tool are answered by it directly, the others by the main agent
+        result = run_routed(query, tools, memory=st.session_state.memory, callbacks=callbacks)
+        if result is None:
+            result = run_agent(query, st.session_state["agent_chain"],
+                               answer_cache=get_answer_cache(), scope=st.session_state["answer_scope"],
+                               callbacks=callbacks)
         st.session_state['history'].append((query, result))
 
         return result
@@ -238,7 +429,20 @@ if uploaded_file:
             submit_button = st.form_submit_button(label='Send')
 
         if submit_button and user_input:
-            output = conversational_chat(user_input)
+            # the answer is streamed here while the agents run, afterwards it is shown with the chat history
+            status_placeholder = st.empty()
+            answer_placeholder = st.empty()
+            from utilities.router import route_question
+            from utilities.streaming import StreamlitStreamHandler
+            from utilities.tracing_callbacks import TracingCallbackHandler
+
+            # answers of routed questions come from the tool's sub-agent, one level below the main agent
+            answer_depth = 1 if route_question(user_input, tools) is not None else 0
+            stream_handler = StreamlitStreamHandler(answer_placeholder, status_placeholder, answer_depth=answer_depth)
+            with tracer.request("chat", model=MODEL) as trace:
+                output = conversational_chat(user_input, callbacks=[stream_handler, TracingCallbackHandler()])
+            stream_handler.clear()
+            st.session_state["chat_trace"] = trace.summary()
 
             st.session_state['past'].append(user_input)
             st.session_state['generated'].append(output)
@@ -250,6 +454,20 @@ if uploaded_file:
                 message(st.session_state["past"][i], is_user=True, key=str(i) + '_user', avatar_style="big-smile")
                 message(st.session_state["generated"][i], key=str(i), avatar_style="bottts")
 
+    if "memory" in st.session_state and "chat_trace" in st.session_state:
+        with st.sidebar.expander("Conversation memory", expanded=False):
+            # prompt tokens of the last question against what replaying every turn in full would add
+            st.write({"last_question_prompt_tokens": st.session_state["chat_trace"]["prompt_tokens"],
+                      "last_question_llm_calls": st.session_state["chat_trace"]["llm_calls"],
+                      **st.session_state.memory.stats()})
+
+    if SHOW_TRACES:
+        with st.sidebar.expander("Request traces", expanded=True):
+            st.caption(f"Exported to {tracer.path}")
+            for trace_key in ["chat_trace", "build_tools_trace"]:
+                if trace_key in st.session_state:
+                    st.write(st.session_state[trace_key])
+
     # Display stored conversation sessions in the sidebar
     if st.session_state["stored_session"]:
         for i, sublist in enumerate(st.session_state["stored_session"]):
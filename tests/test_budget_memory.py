@@ -0,0 +1,22 @@
+from benchmarks.fakes import FakeAzureChatOpenAI
+from utilities.budget_memory import TokenBudgetMemory
+
+
+def test_history_stays_under_the_limit_with_turns_larger_than_it():
+    memory = TokenBudgetMemory(llm=FakeAzureChatOpenAI(), max_token_limit=300, max_message_tokens=300)
+    for turn in range(5):
+        memory.save_context({"input": f"question {turn} " + "why " * 400},
+                            {"output": f"answer {turn} " + "because " * 400})
+        assert memory.history_tokens() <= 300
+
+    assert memory.summarized_turns > 0
+    assert memory.stats()["saved_tokens"] > 0
+
+
+def test_clear_resets_the_counters():
+    memory = TokenBudgetMemory(llm=FakeAzureChatOpenAI(), max_token_limit=300)
+    for _ in range(3):
+        memory.save_context({"input": "question " + "why " * 200}, {"output": "answer " + "because " * 200})
+    memory.clear()
+    assert memory.stats() == {"turns": 0, "summarized_turns": 0, "history_tokens": 0, "unbudgeted_tokens": 0,
+                              "saved_tokens": 0, "summary_cache_hits": 0}
@@ -0,0 +1,101 @@
+import random
+
+from utilities.chunking import BoilerplateStripper, SimHashIndex, simhash, strip_extraction_noise
+
+
+WORDS = ("agent policy value reward state action network learning gradient actor critic replay buffer target "
+         "update sample episode environment discount return estimate function method training model").split()
+
+
+def make_text(seed: int, length: int = 180) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def make_pages(num_pages: int = 10):
+    pages = []
+    for page in range(1, num_pages + 1):
+        body = "\n".join(f"{make_text(page * 100 + line, 12)}." for line in range(10))
+        text = f"Journal of Reinforcement Learning, Vol. 3\nDOI 10.1000/jrl.{page}\n{body}\nPage {page} of {num_pages}"
+        pages.append((text, {"page": page}))
+    return pages
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def test_boilerplate_stripper_removes_running_header_and_footer():
+    pages = make_pages()
+    stripper = BoilerplateStripper()
+    stripped = list(stripper.strip_pages(pages))
+
+    assert [metadata for _, metadata in stripped] == [metadata for _, metadata in pages]
+    for (text, _), (original, _) in zip(stripped, pages):
+        assert "Journal of Reinforcement Learning" not in text
+        assert "DOI" not in text
+        assert "Page " not in text
+        # the body is kept in full
+        assert text.splitlines() == original.splitlines()[2:-1]
+    assert stripper.removed_lines == 3 * len(pages)
+
+
+def test_boilerplate_stripper_keeps_lines_of_a_single_page():
+    pages = make_pages()
+    pages[4] = (pages[4][0] + "\nA footnote only on this page", pages[4][1])
+    stripped = list(BoilerplateStripper().strip_pages(pages))
+    assert stripped[4][0].endswith("A footnote only on this page")
+
+
+def test_boilerplate_stripper_leaves_short_pages_and_short_documents_alone():
+    short_pages = [(f"Title\nline {page}\nPage {page}", {"page": page}) for page in range(1, 10)]
+    assert list(BoilerplateStripper().strip_pages(short_pages)) == short_pages
+
+    # two pages are not enough to tell boilerplate from content
+    pages = make_pages(2)
+    assert list(BoilerplateStripper().strip_pages(pages)) == pages
+
+
+def test_simhash_distance_separates_near_duplicates_from_unrelated_texts():
+    text = make_text(1)
+    words = text.split()
+    words[50] = "changed"
+    near = " ".join(words)
+
+    assert simhash(text) == simhash(text)
+    assert hamming(simhash(text), simhash(near)) <= 6
+    assert min(hamming(simhash(text), simhash(make_text(seed))) for seed in range(2, 50)) > 10
+
+
+def test_simhash_index_drops_duplicates_only():
+    index = SimHashIndex()
+    text = make_text(1)
+    words = text.split()
+    words[90] = "changed"
+
+    assert index.add(text)
+    assert not index.add(text)
+    assert not index.add(" ".join(words))
+    assert all(index.add(make_text(seed)) for seed in range(2, 30))
+    assert index.duplicates == 2
+
+
+def test_strip_extraction_noise_removes_garbled_equation_lines():
+    text = "\n".join([
+        "The policy \x19\x12 maximizes the expected return",
+        "Q\x03(s;a) =E",
+        "(2)",
+        "=",
+        "reported in 2018 by [13]",
+        "",
+        "0.95 0.87",
+    ])
+    cleaned, removed = strip_extraction_noise(text)
+    assert cleaned.splitlines() == ["The policy  maximizes the expected return", "reported in 2018 by [13]",
+                                    "0.95 0.87"]
+    assert removed == 3
+
+
+def test_strip_extraction_noise_keeps_non_latin_text_and_table_rows():
+    lines = ["Обучение с подкреплением", "强化学习", "数据", "Ενισχυτική μάθηση", "1 2 3", "k=0", "12 | 7.5 | 3"]
+    assert strip_extraction_noise("\n".join(lines)) == ("\n".join(lines), 0)
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from utilities.csv_engine import CsvEngine
+
+
+def test_queries_cannot_read_files(tmp_path):
+    secret = tmp_path / "secret.csv"
+    secret.write_text("password\nhunter2\n")
+    engine = CsvEngine()
+    engine.register("sales.csv", pd.DataFrame({"amount": [1, 2, 3]}))
+
+    for sql in (f"SELECT * FROM read_csv_auto('{secret}')", f"SELECT * FROM '{secret}'",
+                f"SELECT * FROM glob('{tmp_path}/*')"):
+        result = engine.query(sql)
+        assert result.startswith("Error:")
+        assert "hunter2" not in result
+
+
+def test_parquet_tables_are_queried_without_file_access(tmp_path):
+    path = str(tmp_path / "large.parquet")
+    pd.DataFrame({"amount": range(10)}).to_parquet(path)
+    engine = CsvEngine()
+    table_name = engine.register_parquet("large.csv", path, fingerprint="large")
+
+    assert engine.query(f'SELECT SUM(amount) AS total FROM "{table_name}"').split() == ["total", "45"]
+    engine.unregister(table_name)
+    assert engine.table_names == []
@@ -0,0 +1,48 @@
+import io
+
+import pandas as pd
+
+from utilities.csv_loader import downcast_numeric, estimate_memory, load_csv, stream_to_parquet
+from utilities.csv_profile import profile_parquet
+
+
+def make_csv(num_rows: int = 20000, late_type_change: bool = False) -> bytes:
+    df = pd.DataFrame({
+        "id": range(num_rows),
+        "city": ["Paris", "Rome", "Oslo", "Lima"] * (num_rows // 4),
+        "price": [i / 10 for i in range(num_rows)],
+    })
+    if late_type_change:
+        df["id"] = df["id"].astype(object)
+        df.loc[num_rows - 1, "id"] = "unknown"
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def test_estimate_memory_is_close_to_the_loaded_size():
+    data = make_csv()
+    _, report = load_csv(io.BytesIO(data))
+    estimate = estimate_memory(io.BytesIO(data), sample_rows=1000)
+    assert 0.5 * report["bytes_after"] < estimate < 2 * report["bytes_after"]
+
+
+def test_stream_to_parquet_keeps_every_row_and_profiles_it(tmp_path):
+    # the type of "id" changes on the last row, the conversion must not fail on it
+    csv_file = io.BytesIO(make_csv(late_type_change=True))
+    path, report = stream_to_parquet(csv_file, str(tmp_path), "upload")
+
+    assert report["rows"] == 20000 and report["columns"] == 3
+    assert list(tmp_path.iterdir()) == [tmp_path / "upload.parquet"]
+    assert csv_file.tell() == 0
+    df = pd.read_parquet(path)
+    assert df["id"].iloc[-1] == "unknown"
+
+    profile = profile_parquet(path).splitlines()
+    assert profile[1].startswith('- "city" varchar, 0 nulls, 4 distinct, top: ')
+    assert profile[2].startswith('- "price" double, 0 nulls, min 0, max 1999.9')
+
+
+def test_floats_are_only_downcast_when_exact():
+    df = downcast_numeric(pd.DataFrame({"price": [10.57, 3.2, 1.0], "ratio": [0.5, 1.25, None]}))
+    assert df["price"].dtype == "float64"
+    assert df["price"].sum() == 10.57 + 3.2 + 1.0
+    assert df["ratio"].dtype == "float32"
@@ -0,0 +1,93 @@
+import time
+import threading
+from typing import List
+
+import pytest
+
+from utilities.embedding_scheduler import EmbeddingScheduler, ScheduledEmbeddings, TokenBucket
+
+
+class FlakyEmbeddings:
+    """Local fake: the vector of a text is its length, the first `failures` requests fail like a rate limit"""
+
+    def __init__(self, failures: int = 0, latency: float = 0.0):
+        self.failures = failures
+        self.latency = latency
+        self.requests: List[List[str]] = []
+        self.queries: List[str] = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests.append(list(texts))
+            fail = len(self.requests) <= self.failures
+        if fail:
+            raise RuntimeError("429 Too Many Requests")
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.queries.append(text)
+        return self.embed_documents([text])[0]
+
+
+def test_batches_keep_the_order_of_the_texts():
+    fake = FlakyEmbeddings(latency=0.01)
+    scheduler = EmbeddingScheduler(fake.embed_documents, batch_size=3, max_concurrency=4)
+    texts = ["x" * n for n in range(1, 11)]
+
+    assert scheduler.embed(texts) == [[float(n)] for n in range(1, 11)]
+    assert sorted(len(batch) for batch in fake.requests) == [1, 3, 3, 3]
+    assert scheduler.stats()["chunks"] == 10
+
+
+def test_failed_batches_are_retried_with_backoff():
+    fake = FlakyEmbeddings(failures=2)
+    scheduler = EmbeddingScheduler(fake.embed_documents, batch_size=2, max_concurrency=1, backoff_base=0.01)
+
+    assert scheduler.embed(["a", "bb", "ccc", "dddd"]) == [[1.0], [2.0], [3.0], [4.0]]
+    assert scheduler.retries == 2
+    assert fake.requests == [["a", "bb"], ["a", "bb"], ["a", "bb"], ["ccc", "dddd"]]
+
+
+def test_retries_give_up_after_max_retries():
+    def always_fails(texts: List[str]) -> List[List[float]]:
+        raise RuntimeError("500 Internal Server Error")
+
+    scheduler = EmbeddingScheduler(always_fails, max_retries=2, backoff_base=0.001)
+    with pytest.raises(RuntimeError):
+        scheduler.embed(["a"])
+    assert scheduler.retries == 2
+
+
+def test_queries_go_through_the_scheduler():
+    fake = FlakyEmbeddings(failures=1)
+    embeddings = ScheduledEmbeddings(fake, EmbeddingScheduler(fake.embed_documents, backoff_base=0.01))
+
+    assert embeddings.embed_query("abc") == [3.0]
+    assert fake.queries == ["abc", "abc"]
+    assert embeddings.scheduler.retries == 1
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=20.0, capacity=1.0)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    # the first token is there, the next two take 1/20 s each
+    assert 0.08 <= time.monotonic() - start < 0.5
+
+
+def test_requests_are_rate_limited():
+    fake = FlakyEmbeddings()
+    scheduler = EmbeddingScheduler(fake.embed_documents, batch_size=1, requests_per_minute=1200)
+    start = time.monotonic()
+    scheduler.embed(["a", "b", "c", "d"])
+    # 20 requests per second, the bucket holds 20 so the first ones are not delayed
+    assert time.monotonic() - start < 0.5
+
+    slow = EmbeddingScheduler(fake.embed_documents, batch_size=1, requests_per_minute=60)
+    start = time.monotonic()
+    slow.embed(["a", "b"])
+    # one request per second, the bucket holds one
+    assert time.monotonic() - start >= 0.9
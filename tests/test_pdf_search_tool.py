@@ -0,0 +1,28 @@
+import asyncio
+
+from langchain.schema import Document
+
+from benchmarks.fakes import FakeAzureChatOpenAI, FakeEmbeddings
+from utilities.agent_tools import PdfSearchTool
+from utilities.document_store import DocumentStore
+
+
+def make_tool() -> PdfSearchTool:
+    store = DocumentStore(FakeEmbeddings())
+    store.add("paper.pdf", [
+        Document(page_content="The sensor xyz was designed in 2019 and built in 2020.",
+                 metadata={"source": "paper.pdf", "page": 1}),
+        Document(page_content="The actor critic method learns a policy and a value function.",
+                 metadata={"source": "paper.pdf", "page": 2}),
+    ], name="paper.pdf")
+    return PdfSearchTool(llm=FakeAzureChatOpenAI(), store=store)
+
+
+def test_arun_searches_the_documents_like_run():
+    tool = make_tool()
+    question = "@pdfsearch, when was the sensor xyz built?"
+
+    answer = asyncio.run(tool.arun(question))
+
+    assert "2020" in answer
+    assert answer == tool.run(question)
@@ -0,0 +1,26 @@
+import asyncio
+
+from langchain.schema.messages import HumanMessage
+
+from benchmarks.fakes import FakeAzureChatOpenAI
+from utilities.tracing import tracer
+from utilities.tracing_callbacks import TracingCallbackHandler
+
+
+def test_llm_calls_are_counted_in_sync_and_async_requests():
+    llm = FakeAzureChatOpenAI()
+    messages = [HumanMessage(content="Hello")]
+
+    with tracer.request("sync") as sync_trace:
+        llm(messages, callbacks=[TracingCallbackHandler()])
+
+    async def ask():
+        with tracer.request("async") as trace:
+            await llm.agenerate([messages], callbacks=[TracingCallbackHandler()])
+        return trace
+
+    async_trace = asyncio.run(ask())
+
+    for trace in (sync_trace, async_trace):
+        assert trace.llm_calls == 1
+        assert trace.prompt_tokens > 0 and trace.completion_tokens > 0
@@ -1,18 +1,57 @@
-import os
+import asyncio
+import hashlib
+import threading
 from langchain.agents.agent_toolkits import create_retriever_tool
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.tools import BaseTool
 from langchain.chat_models import AzureChatOpenAI
-from typing import Dict, Union, List, Any
+from typing import TYPE_CHECKING, Dict, Union, List, Any, Optional
 from langchain.agents import initialize_agent, AgentType
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain.vectorstores import FAISS
-from pandas import DataFrame
 from utilities.prompts import PDFSEARCH_PROMPT_PREFIX, CUSTOM_CHATBOT_PREFIX, CUSTOM_CHATBOT_SUFFIX, \
-    CSV_PROMPT_PREFIX, CSV_PROMPT_SUFFIX
+    CSV_PROMPT_SUFFIX, CSV_SQL_PROMPT_PREFIX, CSV_SQL_PROMPT_SUFFIX, CSV_PROFILE_PROMPT_PREFIX
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
-from langchain.agents import Tool
+from langchain.agents import Tool, AgentExecutor
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.manager import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+from langchain.pydantic_v1 import PrivateAttr
+from langchain.schema.messages import get_buffer_string
+from utilities.embedding_cache import CachedEmbeddings, get_cached_embeddings, DEFAULT_CACHE_PATH, \
+    DEFAULT_CACHE_MAX_BYTES
+from utilities.document_store import DocumentStore
+from utilities.index_store import IndexStore
+from utilities.embedding_scheduler import EmbeddingScheduler, ScheduledEmbeddings, DEFAULT_BATCH_SIZE
+from utilities.answer_cache import AnswerCache
+from utilities.context_compression import ContextCompressor, DEFAULT_CONTEXT_TOKENS
+from utilities.tracing import tracer, traced
+
+if TYPE_CHECKING:
+    from langchain.vectorstores import FAISS
+
+
+def corpus_fingerprint(documents: List[Any]) -> str:
+    """Hash of the chunk contents and sources, used to detect when a document set has changed"""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(str(doc.metadata.get("source", "")).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_document_embeddings(embedding_model: str, cache_path: str = DEFAULT_CACHE_PATH,
+                            cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES, **scheduler_kwargs) -> CachedEmbeddings:
+    """Embeddings for pdf chunks: cached on disk, misses are batched and rate limited by an EmbeddingScheduler"""
+    def make_embeddings() -> ScheduledEmbeddings:
+        scheduler_kwargs.setdefault("batch_size", DEFAULT_BATCH_SIZE)
+        # the scheduler retries with backoff and sends one request per batch, the client must not retry nor split
+        embeddings = OpenAIEmbeddings(deployment=embedding_model, max_retries=0,
+                                      chunk_size=scheduler_kwargs["batch_size"])
+        return ScheduledEmbeddings(embeddings, EmbeddingScheduler(embeddings.embed_documents, **scheduler_kwargs))
+
+    return get_cached_embeddings(make_embeddings, model_name=embedding_model, path=cache_path,
+                                 max_bytes=cache_max_bytes)
 
 
 class PdfSearchTool(BaseTool):
@@ -26,50 +65,163 @@ class PdfSearchTool(BaseTool):
     k: int = 10
     embedding_model: str = "embedding"
     doc_chunks: List[Any] = []
+    # incrementally maintained index, takes precedence over doc_chunks when given
+    store: Optional[DocumentStore] = None
+    # saved indexes keyed by corpus fingerprint and embedding model, used for doc_chunks when given
+    index_store: Optional[IndexStore] = None
+    embedding_cache_path: str = DEFAULT_CACHE_PATH
+    embedding_cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES
+    answer_cache: Optional[AnswerCache] = None
+    # the k retrieved chunks are reranked, context_chunks of them are kept and cut to their sentences relevant to
+    # the search, context_tokens in total. 0 hands the k chunks to the sub-agent whole.
+    context_chunks: int = 5
+    context_tokens: int = DEFAULT_CONTEXT_TOKENS
+
+    # index built from doc_chunks, reused until the fingerprint of the document set changes
+    _doc_store: Any = PrivateAttr(default=None)
+    _fingerprint: str = PrivateAttr(default="")
+    # sub-agent built on first use, rebuilt only when the index it searches is replaced
+    _agent_executor: Any = PrivateAttr(default=None)
+    _agent_vectors: Any = PrivateAttr(default=None)
+    # concurrent async runs build the index and the sub-agent in worker threads, only one of them builds
+    _build_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _compressor: Optional[ContextCompressor] = PrivateAttr(default=None)
+
+    def _get_embeddings(self) -> CachedEmbeddings:
+        return get_document_embeddings(self.embedding_model,
+                                       cache_path=self.embedding_cache_path,
+                                       cache_max_bytes=self.embedding_cache_max_bytes)
+
+    def embedding_cache_stats(self) -> Dict[str, float]:
+        return self._get_embeddings().stats()
+
+    def _get_compressor(self) -> Optional[ContextCompressor]:
+        if self.context_tokens <= 0:
+            return None
+        if self._compressor is None:
+            self._compressor = ContextCompressor(top_n=self.context_chunks, max_tokens=self.context_tokens)
+        return self._compressor
 
-    def _get_retriever_tool(self, save_local=False, load_local=False) -> Tool:
-        embeddings = OpenAIEmbeddings(deployment=self.embedding_model)
-        if load_local:
-            vectors = FAISS.load_local(
-                os.path.join(os.path.dirname(os.path.abspath(__file__)), "vectors", "docsearch_vectors"))
-        else:
-            # vectors = FAISS.from_texts(texts=self.text_chunks, embedding=embeddings)
-            vectors = FAISS.from_documents(documents=self.doc_chunks, embedding=embeddings)
-        retriever = vectors.as_retriever(k=self.k)
+    def context_stats(self) -> Dict[str, float]:
+        compressor = self._get_compressor()
+        return compressor.stats() if compressor is not None else {}
+
+    def document_fingerprint(self) -> str:
+        if self.store is not None:
+            return self.store.fingerprint
+        return corpus_fingerprint(self.doc_chunks)
+
+    def _get_store(self) -> DocumentStore:
+        if self.store is not None:
+            return self.store
+
+        fingerprint = corpus_fingerprint(self.doc_chunks)
+        if self._doc_store is None or fingerprint != self._fingerprint:
+            embeddings = self._get_embeddings()
+            store_fingerprint = DocumentStore.fingerprint_of([fingerprint])
+            store = self.index_store.load(store_fingerprint, self.embedding_model, embeddings) \
+                if self.index_store is not None else None
+            if store is None:
+                store = DocumentStore(embeddings)
+                store.add(fingerprint, self.doc_chunks)
+                if self.index_store is not None:
+                    self.index_store.save(store, self.embedding_model)
+            self._doc_store = store
+            self._fingerprint = fingerprint
+        return self._doc_store
+
+    def _get_vectors(self) -> "FAISS":
+        return self._get_store().vectors
+
+    @traced("PdfSearchTool._get_retriever_tool")
+    def _get_retriever_tool(self) -> Tool:
+        store = self._get_store()
+        # dense and BM25 results are fused, so exact ids and part numbers are found too, then compressed so
+        # every step of the sub-agent re-sends only the relevant sentences
+        retriever = store.as_retriever(k=self.k, compressor=self._get_compressor())
         tool = create_retriever_tool(
             retriever,
             "search_given_document",
             "Searches and returns documents regarding the given pdf files."
         )
-        if save_local:
-            vectors.save_local(os.path.join(os.path.dirname(os.path.abspath(__file__)), "vectors", "docsearch_vectors"))
-
         return tool
 
-    def _run(self, tool_input: Union[str, Dict], ) -> str:
-        try:
-            retriever_tool = self._get_retriever_tool()
+    def _get_agent_executor(self) -> AgentExecutor:
+        with self._build_lock:
+            vectors = self._get_vectors()
+            if self._agent_executor is None or vectors is not self._agent_vectors:
+                tools = [self._get_retriever_tool()]
+
+                # agent = OpenAIFunctionsAgent(llm=llm, tools=tools, prompt=prompt)
+                agent = AgentType.ZERO_SHOT_REACT_DESCRIPTION
 
-            tools = [retriever_tool]
+                self._agent_executor = initialize_agent(tools=tools,
+                                                        llm=self.llm,
+                                                        agent=agent,
+                                                        agent_kwargs={'prefix': PDFSEARCH_PROMPT_PREFIX},
+                                                        verbose=self.verbose,
+                                                        handle_parsing_errors=True)
+                self._agent_vectors = vectors
+            return self._agent_executor
 
+    def _answer_scope(self) -> str:
+        return f"{self.name}:{self.llm.deployment_name}:{self.document_fingerprint()}"
+
+    @traced("PdfSearchTool._run")
+    def _run(self, tool_input: Union[str, Dict], run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        try:
             parsed_input = self._parse_input(tool_input)
 
-            # agent = OpenAIFunctionsAgent(llm=llm, tools=tools, prompt=prompt)
-            agent = AgentType.ZERO_SHOT_REACT_DESCRIPTION
+            scope = self._answer_scope()
+            if self.answer_cache is not None:
+                cached = self.answer_cache.get(parsed_input, scope)
+                if cached is not None:
+                    return cached
 
-            agent_executor = initialize_agent(tools=tools,
-                                              llm=self.llm,
-                                              agent=agent,
-                                              agent_kwargs={'prefix': PDFSEARCH_PROMPT_PREFIX},
-                                              callback_manager=self.callbacks,
-                                              verbose=self.verbose,
-                                              handle_parsing_errors=True)
+            agent_executor = self._get_agent_executor()
+
+            # callbacks are attached per call, the agent itself is reused
+            callbacks = run_manager.get_child() if run_manager else None
 
             for i in range(2):
                 try:
                     # response = run_agent(parsed_input, agent_executor)
-                    response_all = agent_executor(parsed_input)
+                    response_all = agent_executor(parsed_input, callbacks=callbacks)
+                    response = response_all["output"]
+                    if self.answer_cache is not None:
+                        self.answer_cache.put(parsed_input, response, scope)
+                    break
+                except Exception as e:
+                    response = str(e)
+                    continue
+
+            return response
+
+        except Exception as e:
+            print(e)
+
+    @traced("PdfSearchTool._arun")
+    async def _arun(self, tool_input: Union[str, Dict],
+                    run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        try:
+            parsed_input = self._parse_input(tool_input)
+
+            # fingerprinting, cache lookups and index builds block, they run in worker threads
+            scope = await asyncio.to_thread(self._answer_scope)
+            if self.answer_cache is not None:
+                cached = await asyncio.to_thread(self.answer_cache.get, parsed_input, scope)
+                if cached is not None:
+                    return cached
+
+            agent_executor = await asyncio.to_thread(self._get_agent_executor)
+            callbacks = run_manager.get_child() if run_manager else None
+
+            for i in range(2):
+                try:
+                    response_all = await agent_executor.acall(parsed_input, callbacks=callbacks)
                     response = response_all["output"]
+                    if self.answer_cache is not None:
+                        await asyncio.to_thread(self.answer_cache.put, parsed_input, response, scope)
                     break
                 except Exception as e:
                     response = str(e)
@@ -89,20 +241,121 @@ class CsvToolSearch(BaseTool):
     description = "useful when the questions includes the term: @csvsearch.\n"
 
     llm: AzureChatOpenAI
-    df: DataFrame
+    # pandas and DuckDB are imported by whoever creates these, not when this module is imported
+    # single DataFrame queried through a pandas agent
+    df: Optional[Any] = None
+    # all uploaded csv files as tables of a CsvEngine queried through a sql agent, takes precedence over df
+    engine: Optional[Any] = None
+    # profile of df computed at upload time, computed on first use if not given
+    profile: str = ""
+
+    answer_cache: Optional[AnswerCache] = None
 
     # data_path: Any
 
-    def _run(self, tool_input: Union[str, Dict], ) -> str:
+    _agent: Any = PrivateAttr(default=None)
+    _fingerprint: str = PrivateAttr(default="")
+    _build_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def document_fingerprint(self) -> str:
+        if self.engine is not None:
+            return self.engine.fingerprint
+        if not self._fingerprint:
+            from pandas.util import hash_pandas_object
+
+            self._fingerprint = hashlib.sha256(hash_pandas_object(self.df, index=True).values.tobytes()).hexdigest()
+        return self._fingerprint
+
+    def _get_prompt_prefix(self) -> str:
+        if not self.profile:
+            from utilities.csv_profile import profile_dataframe
+
+            self.profile = profile_dataframe(self.df)
+        return CSV_PROFILE_PROMPT_PREFIX.format(num_rows=len(self.df), profile=self.profile)
+
+    def _get_sql_agent(self) -> AgentExecutor:
+        sql_tool = Tool(
+            name="sql_db_query",
+            func=self.engine.query,
+            coroutine=self.engine.aquery,
+            description="Runs a DuckDB SQL query over the csv tables and returns the result. "
+                        "Input is a single SQL query."
+        )
+        schema = self.engine.schema().replace("{", "{{").replace("}", "}}")
+        return initialize_agent(tools=[sql_tool],
+                                llm=self.llm,
+                                agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+                                agent_kwargs={'prefix': CSV_SQL_PROMPT_PREFIX.format(schema=schema)},
+                                verbose=True,
+                                handle_parsing_errors=True)
+
+    def _get_agent(self) -> AgentExecutor:
+        with self._build_lock:
+            if self._agent is None and self.engine is not None:
+                self._agent = self._get_sql_agent()
+            elif self._agent is None:
+                from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+
+                # agent = create_csv_agent(self.llm, self.data_path, verbose=True)
+                self._agent = create_pandas_dataframe_agent(llm=self.llm, df=self.df, verbose=True,
+                                                            agent_type=AgentType.OPENAI_FUNCTIONS)
+            return self._agent
+
+    def _answer_scope(self) -> str:
+        return f"{self.name}:{self.llm.deployment_name}:{self.document_fingerprint()}"
+
+    def _get_agent_input(self, tool_input: str) -> str:
+        if self.engine is not None:
+            return tool_input + CSV_SQL_PROMPT_SUFFIX
+        return self._get_prompt_prefix() + tool_input + CSV_PROMPT_SUFFIX
+
+    @traced("CsvToolSearch._run")
+    def _run(self, tool_input: Union[str, Dict], run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        try:
+            scope = self._answer_scope()
+            if self.answer_cache is not None:
+                cached = self.answer_cache.get(tool_input, scope)
+                if cached is not None:
+                    return cached
+
+            agent = self._get_agent()
+            callbacks = run_manager.get_child() if run_manager else None
+
+            for i in range(2):
+                try:
+                    response = agent.run(self._get_agent_input(tool_input), callbacks=callbacks)
+                    if self.answer_cache is not None:
+                        self.answer_cache.put(tool_input, response, scope)
+                    break
+                except Exception as e:
+                    response = str(e)
+                    continue
+
+            return response
+
+        except Exception as e:
+            print(e)
+
+    @traced("CsvToolSearch._arun")
+    async def _arun(self, tool_input: Union[str, Dict],
+                    run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
         try:
+            scope = await asyncio.to_thread(self._answer_scope)
+            if self.answer_cache is not None:
+                cached = await asyncio.to_thread(self.answer_cache.get, tool_input, scope)
+                if cached is not None:
+                    return cached
 
-            # agent = create_csv_agent(self.llm, self.data_path, verbose=True)
-            agent = create_pandas_dataframe_agent(llm=self.llm, df=self.df, verbose=True,
-                                                  agent_type=AgentType.OPENAI_FUNCTIONS)
+            agent = await asyncio.to_thread(self._get_agent)
+            agent_input = await asyncio.to_thread(self._get_agent_input, tool_input)
+            callbacks = run_manager.get_child() if run_manager else None
 
             for i in range(2):
                 try:
-                    response = agent.run(CSV_PROMPT_PREFIX + tool_input + CSV_PROMPT_SUFFIX)
+                    # sql queries run in worker threads, see CsvEngine.aquery
+                    response = await agent.arun(agent_input, callbacks=callbacks)
+                    if self.answer_cache is not None:
+                        await asyncio.to_thread(self.answer_cache.put, tool_input, response, scope)
                     break
                 except Exception as e:
                     response = str(e)
@@ -114,27 +367,88 @@ class CsvToolSearch(BaseTool):
             print(e)
 
 
-def run_agent(question: str, final_agent: Any) -> str:
+def _get_reformat_chain(final_agent: Any, error: Exception) -> LLMChain:
+    """Chain asking the model of the agent to turn an unparsable agent output into a readable answer"""
+    return LLMChain(
+        llm=final_agent.agent.llm_chain.llm,
+        prompt=PromptTemplate(
+            input_variables=["error"],
+            template="Remove any json formating from the below text, also remove any portion "
+            'that says someting similar this "Could not parse LLM output: ". '
+            "Reformat your response in beautiful Markdown. Just give me the "
+            f"reformated text, nothing else.\n Text: {error}",
+        ),
+        verbose=False,
+    )
+
+
+def conversation_scope(scope: str, memory: Any) -> str:
+    """
+    Scope of the main agent's answers in the answer cache. A follow-up question ("and the second one?") means
+    something else in another conversation, so answers are only reused for the same history, e.g. for the first
+    question of any conversation.
+    """
+    if memory is None:
+        return scope
+    history = memory.load_memory_variables({}).get(memory.memory_key, "")
+    if not isinstance(history, str):
+        history = get_buffer_string(history)
+    return f"{scope}:{hashlib.sha256(history.encode('utf-8')).hexdigest()[:16]}"
+
+
+@traced("run_agent")
+def run_agent(question: str, final_agent: Any, answer_cache: Optional[AnswerCache] = None, scope: str = "",
+              callbacks: Optional[List[BaseCallbackHandler]] = None) -> str:
     """Function to run the brain agent and deal with potential parsing errors"""
+    if answer_cache is not None:
+        # taken before the question is added to the history
+        scope = conversation_scope(scope, final_agent.memory)
+        cached = answer_cache.get(question, scope)
+        if cached is not None:
+            # keep the conversation history consistent with what the user sees
+            if final_agent.memory is not None:
+                final_agent.memory.save_context({"input": question}, {"output": cached})
+            return cached
+
     for _ in range(2):
         try:
-            response = final_agent(question)["output"]
+            response = final_agent(question, callbacks=callbacks)["output"]
+            if answer_cache is not None:
+                answer_cache.put(question, response, scope)
             break
         except Exception as e:
             # If the agent has a parsing error, we use OpenAI model again to reformat the error and give a good answer
             print("parsing error")
-            chatgpt_chain = LLMChain(
-                llm=final_agent.agent.llm_chain.llm,
-                prompt=PromptTemplate(
-                    input_variables=["error"],
-                    template="Remove any json formating from the below text, also remove any portion "
-                    'that says someting similar this "Could not parse LLM output: ". '
-                    "Reformat your response in beautiful Markdown. Just give me the "
-                    f"reformated text, nothing else.\n Text: {e}",
-                ),
-                verbose=False,
-            )
-            response = chatgpt_chain.run(str(e))
+            with tracer.span("run_agent.reformat", error=type(e).__name__):
+                response = _get_reformat_chain(final_agent, e).run(str(e), callbacks=callbacks)
             continue
     return response
 
+
+@traced("arun_agent")
+async def arun_agent(question: str, final_agent: Any, answer_cache: Optional[AnswerCache] = None, scope: str = "",
+                     callbacks: Optional[List[BaseCallbackHandler]] = None) -> str:
+    """
+    Async run_agent. LLM calls and the tools' async paths share the event loop, so concurrent questions overlap,
+    and so do the tool calls of an agent step that asks for several tools at once.
+    """
+    if answer_cache is not None:
+        scope = conversation_scope(scope, final_agent.memory)
+        cached = await asyncio.to_thread(answer_cache.get, question, scope)
+        if cached is not None:
+            if final_agent.memory is not None:
+                final_agent.memory.save_context({"input": question}, {"output": cached})
+            return cached
+
+    for _ in range(2):
+        try:
+            response = (await final_agent.acall(question, callbacks=callbacks))["output"]
+            if answer_cache is not None:
+                await asyncio.to_thread(answer_cache.put, question, response, scope)
+            break
+        except Exception as e:
+            print("parsing error")
+            with tracer.span("arun_agent.reformat", error=type(e).__name__):
+                response = await _get_reformat_chain(final_agent, e).arun(str(e), callbacks=callbacks)
+            continue
+    return response
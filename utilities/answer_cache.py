@@ -0,0 +1,109 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+
+# numbers and tokens containing digits (2021, 3.5, xyz-100/b, s12), and upper case codes (ABC, PT_100)
+_IDENTIFIER_PATTERN = re.compile(r"[\w\-./]*\d[\w\-./]*|\b[A-Z][A-Z0-9_\-]+\b")
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?.!")
+
+
+def question_identifiers(question: str) -> FrozenSet[str]:
+    """
+    Numbers and ids of a question. Questions differing only in these embed almost identically ("status of sensor
+    12" / "status of sensor 13") but have different answers.
+    """
+    return frozenset(token.strip(".-/").lower() for token in _IDENTIFIER_PATTERN.findall(question))
+
+
+class AnswerCache:
+    """
+    Cache of final answers keyed by the normalized question. When there is no exact match, a question whose
+    embedding has a cosine similarity of at least `threshold` with a cached one, and the same numbers and ids
+    (see question_identifiers), is treated as the same question.
+    Entries live in a scope (e.g. the fingerprint of the documents a tool searches), so answers are never reused
+    once the documents change. Each scope keeps at most max_entries answers, the least recently used are dropped.
+    """
+
+    def __init__(self, embeddings: Optional[Embeddings] = None, threshold: float = 0.95, max_entries: int = 1000):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # scope -> normalized question -> (unit embedding or None, answer, identifiers)
+        self._entries: Dict[str, OrderedDict] = {}
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, question: str, scope: str = "") -> Optional[str]:
+        key = normalize_question(question)
+        with self._lock:
+            entries = self._entries.get(scope)
+            if entries and key in entries:
+                entries.move_to_end(key)
+                self.exact_hits += 1
+                return entries[key][1]
+            identifiers = question_identifiers(question)
+            candidates = [(k, vector) for k, (vector, _, entry_identifiers) in entries.items()
+                          if vector is not None and entry_identifiers == identifiers] if entries else []
+
+        if candidates:
+            vector = self._embed(key)
+            if vector is not None:
+                similarities = np.stack([candidate for _, candidate in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    with self._lock:
+                        entry = self._entries.get(scope, {}).get(candidates[best][0])
+                        if entry is not None:
+                            self.similar_hits += 1
+                            return entry[1]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question: str, answer: str, scope: str = ""):
+        key = normalize_question(question)
+        vector = self._embed(key)
+        with self._lock:
+            entries = self._entries.setdefault(scope, OrderedDict())
+            entries[key] = (vector, answer, question_identifiers(question))
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self, scope: Optional[str] = None):
+        with self._lock:
+            if scope is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(scope, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": sum(len(entries) for entries in self._entries.values()),
+            }
@@ -0,0 +1,187 @@
+import re
+import asyncio
+import math
+from collections import Counter, defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from langchain.callbacks.manager import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain.pydantic_v1 import PrivateAttr
+from langchain.schema import BaseRetriever, Document
+from langchain.vectorstores import FAISS
+
+from utilities.tracing import traced
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound tokens such as part numbers ("xyz-100/b") are kept whole and also split
+    into their parts, so both the exact id and its pieces can match.
+    """
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """In-memory inverted index scoring documents with Okapi BM25. Documents can be added and removed by id."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {doc id: term frequency}
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def copy(self) -> "BM25Index":
+        """Copy that can be changed without changing this index"""
+        index = BM25Index(self.k1, self.b)
+        index.postings = defaultdict(dict, {term: dict(docs) for term, docs in self.postings.items()})
+        index.doc_lengths = dict(self.doc_lengths)
+        index._total_length = self._total_length
+        return index
+
+    def add(self, ids: List[str], texts: List[str]):
+        for doc_id, text in zip(ids, texts):
+            if doc_id in self.doc_lengths:
+                self.remove([doc_id])
+            term_counts = Counter(tokenize(text))
+            for term, count in term_counts.items():
+                self.postings[term][doc_id] = count
+            length = sum(term_counts.values())
+            self.doc_lengths[doc_id] = length
+            self._total_length += length
+
+    def remove(self, ids: List[str]):
+        ids = set(ids) & set(self.doc_lengths)
+        if not ids:
+            return
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for doc_id in ids & docs.keys():
+                del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+        for doc_id in ids:
+            self._total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        num_docs = len(self.doc_lengths)
+        if not num_docs:
+            return []
+        average_length = self._total_length / num_docs
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / average_length
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hashable]], k: int = 60) -> List[Hashable]:
+    """Fuses several ranked lists of keys, each key scores 1 / (k + rank) in every list it appears in"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing FAISS similarity search and BM25 keyword search with reciprocal rank fusion.
+    With a compressor, the k fused candidates are reranked and cut down by it (see ContextCompressor).
+    """
+
+    vectors: FAISS
+    bm25: BM25Index
+    k: int = 10
+    # candidates fetched from each index before fusion
+    fetch_k: int = 20
+    rrf_k: int = 60
+    # a ContextCompressor, not typed here as it imports this module
+    compressor: Optional[Any] = None
+
+    # docstore id -> position in the FAISS index, rebuilt when the index changes
+    _positions: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _positions_of: Tuple[int, int] = PrivateAttr(default=(0, 0))
+
+    def _dense_search(self, query_vector: List[float]) -> List[Tuple[str, Document]]:
+        """FAISS search that also returns the docstore ids, the vectors of the results are read back by id"""
+        _, positions = self.vectors.index.search(np.array([query_vector], dtype=np.float32), self.fetch_k)
+        results = []
+        for position in positions[0]:
+            if position == -1:
+                # fewer chunks than fetch_k
+                continue
+            doc_id = self.vectors.index_to_docstore_id[position]
+            doc = self.vectors.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                results.append((doc_id, doc))
+        return results
+
+    def _document_vectors(self, doc_ids: List[str], documents: List[Document]) -> np.ndarray:
+        index_to_docstore_id = self.vectors.index_to_docstore_id
+        if self._positions_of != (id(index_to_docstore_id), len(index_to_docstore_id)):
+            self._positions = {doc_id: position for position, doc_id in index_to_docstore_id.items()}
+            self._positions_of = (id(index_to_docstore_id), len(index_to_docstore_id))
+        try:
+            return np.stack([self.vectors.index.reconstruct(int(self._positions[doc_id])) for doc_id in doc_ids])
+        except RuntimeError:
+            # not every index type can give its vectors back, the chunks' embeddings are in the embedding cache
+            return np.array(self.vectors.embeddings.embed_documents([doc.page_content for doc in documents]),
+                            dtype=np.float32)
+
+    @traced("HybridRetriever.search")
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # documents are matched across the two indexes by source, page and content
+        def key(doc: Document) -> tuple:
+            return doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content
+
+        documents = {}
+        doc_ids = {}
+        query_vector = self.vectors.embeddings.embed_query(query)
+        dense_ranking = []
+        for doc_id, doc in self._dense_search(query_vector):
+            documents.setdefault(key(doc), doc)
+            doc_ids.setdefault(key(doc), doc_id)
+            dense_ranking.append(key(doc))
+
+        sparse_ranking = []
+        for doc_id, _ in self.bm25.search(query, self.fetch_k):
+            doc = self.vectors.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                documents.setdefault(key(doc), doc)
+                doc_ids.setdefault(key(doc), doc_id)
+                sparse_ranking.append(key(doc))
+
+        fused = reciprocal_rank_fusion([dense_ranking, sparse_ranking], k=self.rrf_k)[:self.k]
+        candidates = [documents[doc_key] for doc_key in fused]
+        if self.compressor is None:
+            return candidates
+        vectors = self._document_vectors([doc_ids[doc_key] for doc_key in fused], candidates)
+        return self.compressor.compress(query, query_vector, candidates, vectors)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # the query embedding and both searches block, they run in a worker thread
+        # the async run manager has no sync counterpart, the sync search reports no callbacks of its own
+        return await asyncio.to_thread(self._get_relevant_documents, query,
+                                       run_manager=CallbackManagerForRetrieverRun.get_noop_manager())
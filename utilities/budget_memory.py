@@ -0,0 +1,131 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.schema.messages import BaseMessage, get_buffer_string
+
+from utilities.tokens import count_tokens, truncate_tokens
+from utilities.tracing import tracer
+
+
+class SummaryCache:
+    """LRU of conversation summaries keyed by the previous summary and the turns folded into it"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(existing_summary: str, new_lines: str) -> str:
+        return hashlib.sha256(f"{existing_summary}\0{new_lines}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def put(self, key: str, summary: str):
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_entries:
+                self._summaries.popitem(last=False)
+
+
+# shared by all conversations, a new chat asking the same questions again does not summarize them again
+summary_cache = SummaryCache()
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    """
+    Conversation memory whose history (summary and recent turns) stays under max_token_limit tokens.
+
+    Answers are saved cut to max_message_tokens, long tool outputs such as tables are replaced by their beginning
+    and a note. A message is also cut to a quarter of max_token_limit, so the latest turn always fits. When the
+    history goes over the limit, the oldest turns are folded into the running summary until the recent turns fit
+    in half the limit, so the summary is updated every few turns instead of on every turn.
+    """
+
+    memory_key: str = "chat_history"
+    return_messages: bool = True
+    max_token_limit: int = 1500
+    max_message_tokens: int = 300
+
+    turns: int = 0
+    summarized_turns: int = 0
+    # tokens the history would have without the budget, every turn in full
+    unbudgeted_tokens: int = 0
+    summary_cache_hits: int = 0
+
+    def _truncate(self, text: str) -> str:
+        # a question and its answer take at most half the limit, the note of the cut included
+        limit = min(self.max_message_tokens, self.max_token_limit // 4)
+        tokens = count_tokens(text)
+        if tokens <= limit:
+            return text
+        note = f"\n... [{tokens} tokens of this answer, the rest is omitted]"
+        return truncate_tokens(text, max(limit - count_tokens(note), 0)) + note
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.turns += 1
+        self.unbudgeted_tokens += count_tokens(input_str) + count_tokens(output_str)
+        self.chat_memory.add_user_message(self._truncate(input_str))
+        self.chat_memory.add_ai_message(self._truncate(output_str))
+        self.prune()
+
+    def _count_messages(self, messages: List[BaseMessage]) -> int:
+        return sum(count_tokens(str(message.content)) for message in messages)
+
+    def history_tokens(self) -> int:
+        return count_tokens(self.moving_summary_buffer) + self._count_messages(self.chat_memory.messages)
+
+    def prune(self) -> None:
+        if self.history_tokens() <= self.max_token_limit:
+            return
+        buffer = self.chat_memory.messages
+        pruned = []
+        # whole turns are folded, the summary gets a question together with its answer
+        while len(buffer) > 2 and self._count_messages(buffer) > self.max_token_limit // 2:
+            pruned.extend([buffer.pop(0), buffer.pop(0)])
+        if pruned:
+            self.summarized_turns += len(pruned) // 2
+            self.moving_summary_buffer = self._summarize(pruned, self.moving_summary_buffer)
+        summary_limit = max(self.max_token_limit - self._count_messages(buffer), 0)
+        if count_tokens(self.moving_summary_buffer) > summary_limit:
+            self.moving_summary_buffer = truncate_tokens(self.moving_summary_buffer, summary_limit)
+
+    def _summarize(self, messages: List[BaseMessage], existing_summary: str) -> str:
+        new_lines = get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        key = SummaryCache.key(existing_summary, new_lines)
+        summary = summary_cache.get(key)
+        if summary is not None:
+            self.summary_cache_hits += 1
+            return summary
+        with tracer.span("memory.summarize", turns=len(messages) // 2):
+            summary = self.predict_new_summary(messages, existing_summary)
+        summary_cache.put(key, summary)
+        return summary
+
+    def stats(self) -> Dict[str, int]:
+        history_tokens = self.history_tokens()
+        return {
+            "turns": self.turns,
+            "summarized_turns": self.summarized_turns,
+            "history_tokens": history_tokens,
+            "unbudgeted_tokens": self.unbudgeted_tokens,
+            "saved_tokens": max(self.unbudgeted_tokens - history_tokens, 0),
+            "summary_cache_hits": self.summary_cache_hits,
+        }
+
+    def clear(self) -> None:
+        super().clear()
+        self.turns = 0
+        self.summarized_turns = 0
+        self.unbudgeted_tokens = 0
+        self.summary_cache_hits = 0
@@ -0,0 +1,152 @@
+import re
+import hashlib
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+
+# part of the key of saved indexes, changing how pdfs are chunked must not reuse indexes of the old chunks
+CHUNKING_VERSION = "tokens-256-16-symbols-boilerplate-simhash"
+
+# control characters left by fonts whose glyphs PyPDF2 cannot map, e.g. greek letters of equations
+_CONTROL_CHARACTERS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+# letters of any script and digits
+_CONTENT_CHARACTER = re.compile(r"[^\W_]")
+
+
+def _is_noise(line: str) -> bool:
+    """
+    A line with as many symbols and control characters as letters and digits, e.g. "(2)", "=" or the pieces of
+    a garbled equation. Lines of any script and numeric table rows such as "1 2 3" are content.
+    """
+    characters = len("".join(line.split()))
+    content = len(_CONTENT_CHARACTER.findall(line))
+    return content == 0 or characters - content >= content
+
+
+def strip_extraction_noise(text: str) -> Tuple[str, int]:
+    """
+    Removes control characters and the lines that are mostly symbols, such as the pieces of garbled equations.
+    Returns the cleaned text and the number of lines removed.
+    """
+    kept = []
+    removed = 0
+    for line in text.splitlines():
+        if not _is_noise(line):
+            kept.append(_CONTROL_CHARACTERS.sub("", line))
+        elif line.strip():
+            removed += 1
+    return "\n".join(kept), removed
+
+
+# lines are compared without case, spacing and digits, so "Page 3 of 20" matches "Page 4 of 20"
+def _normalize_line(line: str) -> str:
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+
+class BoilerplateStripper:
+    """
+    Removes running headers and footers from the pages of a document.
+
+    A line is boilerplate when, normalized, it is one of the first or last edge_lines lines of at least
+    min_ratio of the first sample_pages pages. Pages are streamed: only the sample is held back while the
+    boilerplate is learned, later pages are cleaned as they come.
+    """
+
+    def __init__(self, sample_pages: int = 8, edge_lines: int = 3, min_ratio: float = 0.5, min_pages: int = 3):
+        self.sample_pages = sample_pages
+        self.edge_lines = edge_lines
+        self.min_ratio = min_ratio
+        self.min_pages = min_pages
+        self.boilerplate: Set[str] = set()
+        self.removed_lines = 0
+
+    def _has_body(self, lines: List[str]) -> bool:
+        # on pages this short every line is an edge line, they are left alone
+        return len(lines) > 2 * self.edge_lines
+
+    def _edges(self, lines: List[str]) -> Set[str]:
+        edge = lines[:self.edge_lines] + lines[-self.edge_lines:]
+        return {_normalize_line(line) for line in edge if line.strip()}
+
+    def learn(self, pages: List[str]):
+        counts = Counter()
+        for text in pages:
+            lines = text.splitlines()
+            if self._has_body(lines):
+                counts.update(self._edges(lines))
+        threshold = max(self.min_pages, self.min_ratio * len(pages))
+        self.boilerplate = {line for line, count in counts.items() if count >= threshold}
+
+    def strip(self, text: str) -> str:
+        lines = text.splitlines()
+        if not self.boilerplate or not self._has_body(lines):
+            return text
+        edge_indices = set(range(self.edge_lines)) | set(range(len(lines) - self.edge_lines, len(lines)))
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edge_indices and _normalize_line(line) in self.boilerplate:
+                self.removed_lines += 1
+                continue
+            kept.append(line)
+        return "\n".join(kept)
+
+    def strip_pages(self, pages: Iterable[Tuple[str, Dict]]) -> Iterator[Tuple[str, Dict]]:
+        pages = iter(pages)
+        sample = []
+        for page in pages:
+            sample.append(page)
+            if len(sample) >= self.sample_pages:
+                break
+        self.learn([text for text, _ in sample])
+        for text, metadata in sample:
+            yield self.strip(text), metadata
+        for text, metadata in pages:
+            yield self.strip(text), metadata
+
+
+def simhash(text: str, bits: int = 64, shingle_size: int = 3) -> int:
+    """SimHash of the word shingles of text, near-duplicate texts differ in only a few bits"""
+    words = re.findall(r"\w+", text.lower())
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(len(words) - shingle_size + 1, 1))]
+    weights = [0] * bits
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+class SimHashIndex:
+    """
+    Fingerprints of the chunks seen so far, to drop near-duplicates before they are embedded.
+
+    Two fingerprints within max_distance bits share at least one of max_distance + 1 bands, so candidates are
+    found by exact band lookups instead of comparing every pair. For chunks of a few hundred tokens, a distance
+    of 6 of 64 bits catches most copies with a word or two changed. The distinct chunks of
+    data/AlMahamid_2022.pdf are 15 or more bits apart, even as the former 250-character chunks.
+    """
+
+    def __init__(self, max_distance: int = 6, bits: int = 64):
+        self.max_distance = max_distance
+        self.bits = bits
+        self.num_bands = max_distance + 1
+        self.band_bits = bits // self.num_bands
+        self._bands: List[Dict[int, List[int]]] = [{} for _ in range(self.num_bands)]
+        self.duplicates = 0
+
+    def _band_values(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [fingerprint >> (band * self.band_bits) & mask for band in range(self.num_bands)]
+
+    def add(self, text: str) -> bool:
+        """Adds the fingerprint of text, returns False if a near-duplicate was already added"""
+        fingerprint = simhash(text, self.bits)
+        band_values = self._band_values(fingerprint)
+        for band, value in enumerate(band_values):
+            for other in self._bands[band].get(value, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    self.duplicates += 1
+                    return False
+        for band, value in enumerate(band_values):
+            self._bands[band].setdefault(value, []).append(fingerprint)
+        return True
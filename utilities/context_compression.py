@@ -0,0 +1,184 @@
+import re
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Sequence
+
+import numpy as np
+from langchain.schema import Document
+
+from utilities.bm25 import tokenize
+from utilities.tokens import count_tokens
+from utilities.tracing import traced
+
+
+# tokens of retrieved text handed to the pdf sub-agent per search, down from the ~2500 of 10 whole chunks
+DEFAULT_CONTEXT_TOKENS = 800
+
+# question words and function words, a sentence sharing only these with the query is not related to it
+_STOP_WORDS = frozenset("""
+a an and are as at be by can do does for from how in is it its of on or that the their this to was were what when
+where which who why with about into than then there these those they did has have had not no
+""".split())
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\"'])|\n{2,}")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Splits on sentence ends and blank lines, lines wrapped by the pdf extraction are joined back"""
+    sentences = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = " ".join(sentence.split())
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def cosine_similarities(query_vector: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+    return vectors @ query_vector / np.maximum(norms, 1e-12)
+
+
+def lexical_scores(query: str, texts: Sequence[str]) -> np.ndarray:
+    """
+    Share of the query's terms found in each text, each term weighted by its idf among the texts, so a rare
+    term of the query counts more than one every candidate contains. Scores are between 0 and 1.
+    """
+    query_terms = set(tokenize(query)) - _STOP_WORDS
+    text_terms = [set(tokenize(text)) for text in texts]
+    if not query_terms or not texts:
+        return np.zeros(len(texts), dtype=np.float32)
+    document_frequency = Counter(term for terms in text_terms for term in terms & query_terms)
+    idf = {term: math.log(1 + (len(texts) + 1) / (document_frequency[term] + 0.5)) for term in query_terms}
+    total = sum(idf.values())
+    return np.array([sum(idf[term] for term in terms & query_terms) / total for terms in text_terms],
+                    dtype=np.float32)
+
+
+def maximal_marginal_relevance(relevance: np.ndarray, vectors: np.ndarray, top_n: int,
+                               diversity: float = 0.3) -> List[int]:
+    """
+    Indices of top_n candidates, each picked for its relevance minus its similarity to those already picked,
+    so near-identical chunks do not fill the context
+    """
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    pairwise = unit @ unit.T
+    selected = []
+    max_similarity = np.zeros(len(relevance), dtype=np.float32)
+    remaining = np.ones(len(relevance), dtype=bool)
+    for _ in range(min(top_n, len(relevance))):
+        scores = np.where(remaining, (1 - diversity) * relevance - diversity * max_similarity, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        remaining[best] = False
+        max_similarity = np.maximum(max_similarity, pairwise[best])
+    return selected
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    spread = scores.max() - scores.min() if len(scores) else 0
+    return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+
+class ContextCompressor:
+    """
+    Post-retrieval stage run on CPU before the retrieved chunks reach the pdf sub-agent.
+
+    Candidates are reranked by a mix of the cosine similarity of their embeddings (already in the FAISS index) to
+    the query and of their lexical overlap with the query, top_n of them are picked with maximal marginal
+    relevance, and only their sentences most related to the query are kept, up to max_tokens in total.
+    """
+
+    def __init__(self, top_n: int = 5, max_tokens: int = DEFAULT_CONTEXT_TOKENS, semantic_weight: float = 0.7,
+                 diversity: float = 0.3):
+        self.top_n = top_n
+        self.max_tokens = max_tokens
+        self.semantic_weight = semantic_weight
+        self.diversity = diversity
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def rerank(self, query: str, query_vector: Sequence[float], documents: List[Document],
+               vectors: np.ndarray) -> List[Document]:
+        """The top_n documents in order, picked with MMR over the combined cosine and lexical scores"""
+        if not documents:
+            return []
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        relevance = self.semantic_weight * _min_max(cosine_similarities(query_vector, vectors)) + \
+            (1 - self.semantic_weight) * lexical_scores(query, [doc.page_content for doc in documents])
+        return [documents[i] for i in maximal_marginal_relevance(relevance, vectors, self.top_n, self.diversity)]
+
+    def extract(self, query: str, documents: List[Document]) -> List[Document]:
+        """
+        Keeps the sentences of the ranked documents that best match the query, within max_tokens.
+
+        Sentences sharing terms with the query are kept with their neighbours, which often hold the subject or
+        the answer, and a document sharing none keeps its first sentence, as it was ranked for its meaning.
+        A sentence scores its own match plus the rank of its document, so the best documents keep more of their
+        text. Kept sentences stay in their original order, skipped text is marked with "...".
+        """
+        sentences = [(i, j, sentence) for i, doc in enumerate(documents)
+                     for j, sentence in enumerate(split_sentences(doc.page_content))]
+        if not sentences:
+            return []
+        scores = lexical_scores(query, [sentence for _, _, sentence in sentences])
+
+        candidates = set()
+        matched_documents = set()
+        for n, (i, _, _) in enumerate(sentences):
+            if scores[n] > 0:
+                matched_documents.add(i)
+                candidates.update(m for m in (n - 1, n, n + 1)
+                                  if 0 <= m < len(sentences) and sentences[m][0] == i)
+        for n, (i, j, _) in enumerate(sentences):
+            if j == 0 and i not in matched_documents:
+                candidates.add(n)
+        rank_scores = [1 - i / len(documents) for i, _, _ in sentences]
+        order = sorted(candidates, key=lambda n: scores[n] + rank_scores[n], reverse=True)
+
+        kept = set()
+        used = 0
+        for n in order:
+            tokens = count_tokens(sentences[n][2])
+            if used + tokens > self.max_tokens:
+                # a long sentence is skipped, shorter ones of lower rank may still fit
+                continue
+            kept.add(n)
+            used += tokens
+
+        compressed = []
+        for i, doc in enumerate(documents):
+            parts = []
+            previous = -1
+            for n, (doc_index, j, sentence) in enumerate(sentences):
+                if doc_index != i or n not in kept:
+                    continue
+                if j != previous + 1:
+                    parts.append("...")
+                parts.append(sentence)
+                previous = j
+            if parts:
+                compressed.append(Document(page_content=" ".join(parts), metadata=dict(doc.metadata)))
+        return compressed
+
+    @traced("ContextCompressor.compress")
+    def compress(self, query: str, query_vector: Sequence[float], documents: List[Document],
+                 vectors: np.ndarray) -> List[Document]:
+        compressed = self.extract(query, self.rerank(query, query_vector, documents, vectors))
+        with self._lock:
+            self.searches += 1
+            self.input_tokens += sum(count_tokens(doc.page_content) for doc in documents)
+            self.output_tokens += sum(count_tokens(doc.page_content) for doc in compressed)
+        return compressed
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "searches": self.searches,
+                "retrieved_tokens": self.input_tokens,
+                "context_tokens": self.output_tokens,
+                "compression": round(1 - self.output_tokens / self.input_tokens, 3) if self.input_tokens else 0.0,
+            }
@@ -0,0 +1,99 @@
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class _Entry:
+    def __init__(self):
+        self.corpus: Optional[Any] = None
+        self.refs = 0
+        # sessions asking for a corpus that is being built wait for it instead of building it again
+        self.build_lock = threading.Lock()
+
+
+class CorpusHandle:
+    """
+    A session's reference to a shared corpus. The reference is dropped by release(), or when the handle is
+    garbage collected, e.g. with the session state of a closed browser tab.
+    """
+
+    def __init__(self, registry: "CorpusRegistry", key: str, entry: _Entry):
+        self.key = key
+        self.corpus = entry.corpus
+        # bound to the entry, a late release cannot drop a reference to a corpus rebuilt under the same key
+        self._finalizer = weakref.finalize(self, registry._release, key, entry)
+
+    @property
+    def released(self) -> bool:
+        return not self._finalizer.alive
+
+    def release(self):
+        # a finalizer runs at most once, releasing twice is harmless
+        self._finalizer()
+
+
+class CorpusRegistry:
+    """
+    Process-wide corpora (pdf indexes, csv tables) keyed by content hash and shared by all sessions.
+
+    A corpus is built by the first session that acquires it, the others get the same object and must only read
+    it. It is dropped from the registry when the last handle to it is released, so memory grows with the
+    distinct documents in use rather than with the number of sessions.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    def acquire(self, key: str, build: Callable[[], Any]) -> CorpusHandle:
+        """Returns a handle to the corpus of key, calling build() to make it if no session holds it"""
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            entry.refs += 1
+        try:
+            with entry.build_lock:
+                if entry.corpus is None:
+                    entry.corpus = build()
+                    with self._lock:
+                        self.builds += 1
+                else:
+                    with self._lock:
+                        self.shared_hits += 1
+        except Exception:
+            self._release(key, entry)
+            raise
+        return CorpusHandle(self, key, entry)
+
+    def _release(self, key: str, entry: _Entry):
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not entry:
+                return
+            current.refs -= 1
+            if current.refs <= 0:
+                del self._entries[key]
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.corpus if entry is not None else None
+
+    def corpora(self, prefix: str = "") -> List[Tuple[str, Any]]:
+        """The built corpora whose key starts with prefix, with their keys"""
+        with self._lock:
+            return [(key, entry.corpus) for key, entry in self._entries.items()
+                    if key.startswith(prefix) and entry.corpus is not None]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "corpora": len(self._entries),
+                "references": {key: entry.refs for key, entry in self._entries.items()},
+                "builds": self.builds,
+                "shared_hits": self.shared_hits,
+                "evictions": self.evictions,
+            }
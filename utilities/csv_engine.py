@@ -0,0 +1,140 @@
+import re
+import asyncio
+import hashlib
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+import duckdb
+from pandas import DataFrame
+from pandas.util import hash_pandas_object
+
+
+# the agent may only read, the tables are views over dataframes shared with other sessions
+_READ_ONLY_STATEMENT = re.compile(r"^(select|with|from|describe|show|summarize|explain)\b", re.IGNORECASE)
+
+
+class CsvEngine:
+    """
+    In-process DuckDB database holding one table per uploaded csv file.
+
+    DataFrames are registered as views, so DuckDB scans them in place with its vectorized engine instead of
+    copying them. Large files can instead be registered as parquet files that DuckDB scans from disk.
+    Joins and aggregations that do not fit in memory spill to a temporary directory.
+
+    The queries come from an agent, so the connection has no access to files: read_csv_auto('/etc/passwd'),
+    glob() or a file path after FROM are refused by DuckDB itself. Parquet files are registered as pyarrow
+    datasets, which DuckDB scans through arrow rather than by opening the file.
+    """
+
+    def __init__(self, memory_limit: str = "2GB", max_rows: int = 50):
+        self.max_rows = max_rows
+        # table name -> dataframe, None for tables backed by a parquet file
+        self.tables: Dict[str, Optional[DataFrame]] = {}
+        self._hashes: Dict[str, str] = {}
+        # precomputed column profiles, see utilities.csv_profile
+        self.profiles: Dict[str, str] = {}
+        # a duckdb connection must not be used from several threads at once
+        self._lock = threading.Lock()
+        self._temp_dir = tempfile.mkdtemp(prefix="csv_engine_")
+        self._conn = duckdb.connect(database=":memory:")
+        self._conn.execute(f"SET memory_limit = '{memory_limit}'")
+        self._conn.execute(f"SET temp_directory = '{self._temp_dir}'")
+        # cannot be turned back on from a query
+        self._conn.execute("SET enable_external_access = false")
+
+    def _table_name(self, file_name: str) -> str:
+        name = re.sub(r"\.csv$", "", file_name, flags=re.IGNORECASE)
+        name = re.sub(r"\W+", "_", name).strip("_").lower() or "table"
+        if name[0].isdigit():
+            name = f"t_{name}"
+        unique_name, i = name, 1
+        while unique_name in self.tables:
+            i += 1
+            unique_name = f"{name}_{i}"
+        return unique_name
+
+    def register(self, file_name: str, df: DataFrame, profile: str = "", fingerprint: Optional[str] = None) -> str:
+        """
+        Registers the dataframe of a csv file and returns the name of its table. fingerprint identifies its content,
+        e.g. the hash of the uploaded file, the dataframe is hashed when it is not given.
+        """
+        if fingerprint is None:
+            fingerprint = hashlib.sha256(hash_pandas_object(df, index=True).values.tobytes()).hexdigest()
+        with self._lock:
+            table_name = self._table_name(file_name)
+            self._conn.register(table_name, df)
+            self.tables[table_name] = df
+            self.profiles[table_name] = profile
+            self._hashes[table_name] = fingerprint
+            return table_name
+
+    def register_parquet(self, file_name: str, path: str, fingerprint: str, profile: str = "") -> str:
+        """Registers a csv file spilled to parquet, its rows stay on disk until queried"""
+        import pyarrow.dataset
+
+        with self._lock:
+            table_name = self._table_name(file_name)
+            self._conn.register(table_name, pyarrow.dataset.dataset(path, format="parquet"))
+            self.tables[table_name] = None
+            self._hashes[table_name] = fingerprint
+            self.profiles[table_name] = profile
+            return table_name
+
+    def unregister(self, table_name: str):
+        with self._lock:
+            if table_name in self.tables:
+                self._conn.unregister(table_name)
+                del self.tables[table_name]
+                del self._hashes[table_name]
+                del self.profiles[table_name]
+
+    @property
+    def table_names(self) -> List[str]:
+        return list(self.tables)
+
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256(
+            "\0".join(f"{name}:{self._hashes[name]}" for name in sorted(self._hashes)).encode("utf-8")
+        ).hexdigest()
+
+    def schema(self) -> str:
+        """Description of every table with its number of rows and its profile, or its columns and DuckDB types"""
+        descriptions = []
+        with self._lock:
+            for table_name in self.tables:
+                num_rows = self._conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+                if self.profiles.get(table_name):
+                    descriptions.append(f'Table "{table_name}" ({num_rows} rows):\n{self.profiles[table_name]}')
+                    continue
+                columns = self._conn.execute(f'DESCRIBE "{table_name}"').fetchall()
+                column_list = ", ".join(f'"{column[0]}" {column[1]}' for column in columns)
+                descriptions.append(f'Table "{table_name}" ({num_rows} rows): {column_list}')
+        return "\n".join(descriptions)
+
+    def query(self, sql: str) -> str:
+        """Runs a sql query and returns at most max_rows rows as text, errors are returned so they can be fixed"""
+        sql = sql.strip().strip("`").strip()
+        if sql.lower().startswith("sql"):
+            sql = sql[3:]
+        sql = sql.strip().rstrip(";").strip()
+        if not _READ_ONLY_STATEMENT.match(sql) or ";" in sql:
+            return "Error: only a single read-only query (SELECT) is allowed."
+        try:
+            with self._lock:
+                cursor = self._conn.execute(sql)
+                result = cursor.fetchmany(self.max_rows + 1)
+                columns = [column[0] for column in cursor.description]
+        except Exception as e:
+            return f"Error: {e}"
+
+        truncated = len(result) > self.max_rows
+        text = DataFrame(result[:self.max_rows], columns=columns).to_string(index=False)
+        if truncated:
+            text += f"\n... only the first {self.max_rows} rows are shown, aggregate or add a LIMIT."
+        return text
+
+    async def aquery(self, sql: str) -> str:
+        """Runs query in a worker thread, so the event loop is free while DuckDB scans"""
+        return await asyncio.to_thread(self.query, sql)
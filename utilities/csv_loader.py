@@ -0,0 +1,171 @@
+import io
+import os
+import shutil
+import itertools
+from typing import Any, Dict, Tuple
+
+import duckdb
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+SAMPLE_ROWS = 10000
+# string columns with at most this ratio of distinct values in the sample are read as categoricals
+CATEGORICAL_RATIO = 0.5
+
+
+def _rewind(csv_file: Any):
+    if hasattr(csv_file, "seek"):
+        csv_file.seek(0)
+
+
+def _is_path(csv_file: Any) -> bool:
+    return isinstance(csv_file, (str, os.PathLike))
+
+
+def _file_size(csv_file: Any) -> int:
+    if _is_path(csv_file):
+        return os.path.getsize(csv_file)
+    csv_file.seek(0, os.SEEK_END)
+    size = csv_file.tell()
+    _rewind(csv_file)
+    return size
+
+
+def _read_head(csv_file: Any, num_lines: int) -> bytes:
+    """The first lines of the file, as bytes"""
+    if _is_path(csv_file):
+        with open(csv_file, "rb") as f:
+            return b"".join(itertools.islice(f, num_lines))
+    _rewind(csv_file)
+    head = "".join(itertools.islice(csv_file, num_lines)) if isinstance(csv_file, io.TextIOBase) \
+        else b"".join(itertools.islice(csv_file, num_lines))
+    _rewind(csv_file)
+    return head.encode("utf-8") if isinstance(head, str) else head
+
+
+def infer_dtypes(sample: DataFrame, categorical_ratio: float = CATEGORICAL_RATIO) -> Dict[str, str]:
+    """Dtypes to read the full file with, decided from a sample of its rows"""
+    dtypes = {}
+    for column in sample.columns:
+        series = sample[column]
+        if series.dtype == object and series.nunique(dropna=True) <= categorical_ratio * max(len(series), 1):
+            dtypes[column] = "category"
+    return dtypes
+
+
+def downcast_numeric(df: DataFrame, downcast_floats: bool = True) -> DataFrame:
+    """
+    Casts every numeric column to the smallest type that holds its values. Float columns are only cast to float32
+    when all their values round-trip exactly: 10.57 would become 10.5699997 and sums of prices would drift.
+    """
+    for column in df.select_dtypes(include="integer").columns:
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    if downcast_floats:
+        for column in df.select_dtypes(include="float64").columns:
+            values = df[column].to_numpy()
+            downcast = values.astype(np.float32)
+            if np.array_equal(downcast.astype(np.float64), values, equal_nan=True):
+                df[column] = downcast
+    return df
+
+
+def estimate_memory(csv_file: Any, sample_rows: int = SAMPLE_ROWS, categorical_ratio: float = CATEGORICAL_RATIO,
+                    downcast_floats: bool = True) -> int:
+    """
+    Bytes the dataframe of the file would take once loaded by load_csv, estimated from a sample of its first rows
+    and the size of the file, without reading the whole file
+    """
+    head = _read_head(csv_file, sample_rows + 1)
+    sample = pd.read_csv(io.BytesIO(head))
+    if not len(sample):
+        return 0
+    sample = downcast_numeric(sample.astype(infer_dtypes(sample, categorical_ratio)), downcast_floats=downcast_floats)
+    num_rows = len(sample) * _file_size(csv_file) / len(head)
+    return int(sample.memory_usage(deep=True).sum() / len(sample) * num_rows)
+
+
+def load_csv(csv_file: Any, sample_rows: int = SAMPLE_ROWS, categorical_ratio: float = CATEGORICAL_RATIO,
+             use_arrow: bool = True, downcast_floats: bool = True) -> Tuple[DataFrame, Dict[str, Any]]:
+    """
+    Reads a csv file with dtypes inferred from a sample: low-cardinality strings become categoricals and
+    numerics are downcast. The pyarrow engine is used when available. Returns the dataframe and a report of its
+    memory usage with default dtypes (estimated from the sample) and after loading.
+    """
+    sample = pd.read_csv(csv_file, nrows=sample_rows)
+    _rewind(csv_file)
+    dtypes = infer_dtypes(sample, categorical_ratio)
+
+    engine = "pyarrow" if use_arrow and HAS_PYARROW else "c"
+    df = pd.read_csv(csv_file, dtype=dtypes, engine=engine)
+    df = downcast_numeric(df, downcast_floats=downcast_floats)
+
+    sample_bytes = sample.memory_usage(deep=True).sum()
+    report = {
+        "rows": len(df),
+        "columns": len(df.columns),
+        "engine": engine,
+        "categorical_columns": list(dtypes),
+        "bytes_before": int(sample_bytes / max(len(sample), 1) * len(df)),
+        "bytes_after": int(df.memory_usage(deep=True).sum()),
+    }
+    return df, report
+
+
+def stream_to_parquet(csv_file: Any, spill_dir: str, name: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Converts a csv file to a parquet file that DuckDB can scan from disk, without loading it in a dataframe:
+    DuckDB reads and writes it in batches. Returns the path of the parquet file and a report of its size.
+    Uploaded files are first copied to spill_dir, as DuckDB reads from a path.
+    """
+    os.makedirs(spill_dir, exist_ok=True)
+    path = os.path.join(spill_dir, f"{name}.parquet")
+    tmp_path = f"{path}.tmp"
+    csv_path = csv_file
+    if not _is_path(csv_file):
+        csv_path = f"{path}.csv.tmp"
+        _rewind(csv_file)
+        with open(csv_path, "wb") as f:
+            shutil.copyfileobj(csv_file, f)
+        _rewind(csv_file)
+    try:
+        conn = duckdb.connect(database=":memory:")
+        conn.execute(f"SET temp_directory = '{spill_dir}'")
+        escaped_csv_path = csv_path.replace("'", "''")
+        escaped_tmp_path = tmp_path.replace("'", "''")
+        # column types are sniffed from every row, not a sample, so a late row cannot break the conversion
+        conn.execute(f"COPY (SELECT * FROM read_csv_auto('{escaped_csv_path}', sample_size = -1)) "
+                     f"TO '{escaped_tmp_path}' (FORMAT parquet)")
+        num_rows = conn.execute(f"SELECT COUNT(*) FROM read_parquet('{escaped_tmp_path}')").fetchone()[0]
+        num_columns = len(conn.execute(f"DESCRIBE SELECT * FROM read_parquet('{escaped_tmp_path}')").fetchall())
+        conn.close()
+        os.replace(tmp_path, path)
+    finally:
+        if csv_path is not csv_file and os.path.exists(csv_path):
+            os.remove(csv_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    report = {
+        "rows": num_rows,
+        "columns": num_columns,
+        "engine": "duckdb",
+        "bytes_on_disk": os.path.getsize(path),
+    }
+    return path, report
+
+
+def spill_to_parquet(df: DataFrame, spill_dir: str, name: str) -> str:
+    """Writes the dataframe to a parquet file that DuckDB can scan from disk, returns its path"""
+    os.makedirs(spill_dir, exist_ok=True)
+    path = os.path.join(spill_dir, f"{name}.parquet")
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,72 @@
+import duckdb
+from pandas import DataFrame
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    value = str(value)
+    return value if len(value) <= 40 else value[:37] + "..."
+
+
+def profile_dataframe(df: DataFrame, max_categories: int = 5) -> str:
+    """
+    Compact description of every column: dtype, null count, min/max/mean of numeric and datetime columns and the
+    most frequent values of the others. Summaries are computed column-wise in one pass per statistic.
+    """
+    null_counts = df.isna().sum()
+    numeric = df[[column for column in df.columns
+                  if is_numeric_dtype(df[column]) and not is_bool_dtype(df[column])]]
+    numeric_stats = numeric.agg(["min", "max", "mean"]) if len(numeric.columns) else None
+
+    lines = []
+    for column in df.columns:
+        series = df[column]
+        line = f'- "{column}" {series.dtype}, {int(null_counts[column])} nulls'
+        if numeric_stats is not None and column in numeric_stats.columns:
+            stats = numeric_stats[column]
+            line += (f", min {_format_value(stats['min'])}, max {_format_value(stats['max'])}, "
+                     f"mean {_format_value(stats['mean'])}")
+        elif is_datetime64_any_dtype(series):
+            line += f", min {series.min()}, max {series.max()}"
+        else:
+            counts = series.value_counts(dropna=True)
+            top = ", ".join(f"{_format_value(value)} ({count})" for value, count in counts.head(max_categories).items())
+            line += f", {len(counts)} distinct, top: {top}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER",
+                  "UBIGINT", "FLOAT", "DOUBLE", "DECIMAL")
+
+
+def profile_parquet(path: str, max_categories: int = 5) -> str:
+    """Same description as profile_dataframe for a parquet file, computed by DuckDB without loading the file"""
+    conn = duckdb.connect(database=":memory:")
+    table = "read_parquet('{}')".format(path.replace("'", "''"))
+    columns = conn.execute(f"DESCRIBE SELECT * FROM {table}").fetchall()
+    num_rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    lines = []
+    for name, column_type, *_ in columns:
+        column = '"{}"'.format(name.replace('"', '""'))
+        nulls = num_rows - conn.execute(f"SELECT COUNT({column}) FROM {table}").fetchone()[0]
+        line = f'- "{name}" {column_type.lower()}, {nulls} nulls'
+        if column_type.startswith(_NUMERIC_TYPES):
+            minimum, maximum, mean = conn.execute(
+                f"SELECT MIN({column}), MAX({column}), AVG({column}) FROM {table}").fetchone()
+            line += f", min {_format_value(minimum)}, max {_format_value(maximum)}, mean {_format_value(mean)}"
+        elif column_type.startswith(("DATE", "TIMESTAMP")):
+            minimum, maximum = conn.execute(f"SELECT MIN({column}), MAX({column}) FROM {table}").fetchone()
+            line += f", min {minimum}, max {maximum}"
+        else:
+            distinct = conn.execute(f"SELECT COUNT(DISTINCT {column}) FROM {table}").fetchone()[0]
+            counts = conn.execute(f"SELECT {column}, COUNT(*) AS n FROM {table} WHERE {column} IS NOT NULL "
+                                  f"GROUP BY {column} ORDER BY n DESC LIMIT {max_categories}").fetchall()
+            top = ", ".join(f"{_format_value(value)} ({count})" for value, count in counts)
+            line += f", {distinct} distinct, top: {top}"
+        lines.append(line)
+    conn.close()
+    return "\n".join(lines)
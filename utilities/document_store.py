@@ -0,0 +1,184 @@
+import os
+import json
+import pickle
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+from langchain.vectorstores import FAISS
+from langchain.vectorstores.faiss import dependable_faiss_import
+
+from utilities.bm25 import BM25Index, HybridRetriever
+from utilities.tracing import traced
+
+
+def _read_faiss(folder_path: str, embeddings: Embeddings) -> FAISS:
+    faiss = dependable_faiss_import()
+    # read into memory: faiss only memory-maps the inverted lists of IVF indexes, not the IndexFlat used here
+    index = faiss.read_index(os.path.join(folder_path, "index.faiss"))
+    with open(os.path.join(folder_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+class DocumentStore:
+    """FAISS index, with a BM25 index over the same chunks, that grows and shrinks one source file at a time.
+
+    Each source (e.g. the content hash of an uploaded pdf) owns the ids of its chunks, so adding a
+    file only embeds that file's chunks and removing it deletes its vectors by id.
+    A store opened with load_local reads its manifest right away and its indexes on first use.
+    A read_only store is shared between sessions (see CorpusRegistry) and refuses changes.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.source_ids: Dict[str, List[str]] = {}
+        self.source_names: Dict[str, str] = {}
+        self._vectors: Optional[FAISS] = None
+        self._bm25 = BM25Index()
+        # set by load_local
+        self._folder_path: Optional[str] = None
+        self._loaded = True
+        self._load_lock = threading.Lock()
+        self.read_only = False
+
+    @property
+    def vectors(self) -> Optional[FAISS]:
+        self._load()
+        return self._vectors
+
+    @property
+    def bm25(self) -> BM25Index:
+        self._load()
+        return self._bm25
+
+    @property
+    def sources(self) -> List[str]:
+        return list(self.source_ids)
+
+    @staticmethod
+    def fingerprint_of(source_ids: Iterable[str]) -> str:
+        return hashlib.sha256("\0".join(sorted(source_ids)).encode("utf-8")).hexdigest()
+
+    @property
+    def fingerprint(self) -> str:
+        return self.fingerprint_of(self.source_ids)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("This document store is shared read-only, build a new store to change it")
+
+    def _load(self):
+        """Reads the indexes saved in _folder_path into memory"""
+        if self._folder_path is None or self._loaded:
+            return
+        # sessions sharing the store may use it for the first time at once
+        with self._load_lock:
+            if self._loaded:
+                return
+            has_vectors = any(self.source_ids.values())
+            for file_name in ("index.faiss", "bm25.pkl") if has_vectors else ("bm25.pkl",):
+                if not os.path.exists(os.path.join(self._folder_path, file_name)):
+                    raise FileNotFoundError(f"The saved index in {self._folder_path} has no {file_name}, it was "
+                                            f"removed after the store was opened, open it again or rebuild it")
+            if has_vectors:
+                self._vectors = _read_faiss(self._folder_path, self.embeddings)
+            with open(os.path.join(self._folder_path, "bm25.pkl"), "rb") as f:
+                self._bm25 = pickle.load(f)
+            self._loaded = True
+
+    def clone(self) -> "DocumentStore":
+        """
+        Writable copy, to derive the store of another set of files from a shared read-only one by adding and
+        removing sources. The chunk documents are shared, the FAISS and BM25 indexes are copied, which is much
+        cheaper than parsing and embedding the files again.
+        """
+        store = DocumentStore(self.embeddings)
+        store.source_ids = {source_id: list(ids) for source_id, ids in self.source_ids.items()}
+        store.source_names = dict(self.source_names)
+        vectors = self.vectors
+        if vectors is not None:
+            faiss = dependable_faiss_import()
+            store._vectors = FAISS(self.embeddings, faiss.clone_index(vectors.index),
+                                   InMemoryDocstore(dict(vectors.docstore._dict)), dict(vectors.index_to_docstore_id))
+        store._bm25 = self.bm25.copy()
+        return store
+
+    def add(self, source_id: str, documents: List[Document], name: str = ""):
+        self.add_batches(source_id, [documents], name=name)
+
+    @traced("DocumentStore.add_batches")
+    def add_batches(self, source_id: str, batches: Iterable[List[Document]], name: str = ""):
+        """Embeds and appends the chunks of a source batch by batch, so only one batch is held at a time"""
+        self._check_writable()
+        if source_id in self.source_ids:
+            return
+        self._load()
+
+        ids = []
+        for documents in batches:
+            if not documents:
+                continue
+            batch_ids = [f"{source_id}:{len(ids) + i}" for i in range(len(documents))]
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            text_embeddings = list(zip(texts, self.embeddings.embed_documents(texts)))
+            if self._vectors is None:
+                self._vectors = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas,
+                                                      ids=batch_ids)
+            else:
+                self._vectors.add_embeddings(text_embeddings, metadatas=metadatas, ids=batch_ids)
+            self._bm25.add(batch_ids, texts)
+            ids.extend(batch_ids)
+        self.source_ids[source_id] = ids
+        self.source_names[source_id] = name or source_id
+
+    def remove(self, source_id: str):
+        self._check_writable()
+        if source_id not in self.source_ids:
+            return
+        self._load()
+        ids = self.source_ids.pop(source_id)
+        self.source_names.pop(source_id, None)
+        if ids and self._vectors is not None:
+            self._vectors.delete(ids)
+        self._bm25.remove(ids)
+
+    def as_retriever(self, k: int = 10, compressor: Optional[Any] = None) -> HybridRetriever:
+        return HybridRetriever(vectors=self.vectors, bm25=self.bm25, k=k, fetch_k=2 * k, compressor=compressor)
+
+    def manifest(self) -> Dict:
+        return {
+            "fingerprint": self.fingerprint,
+            "num_chunks": sum(len(ids) for ids in self.source_ids.values()),
+            "sources": {source_id: {"name": self.source_names.get(source_id, source_id), "chunk_ids": ids}
+                        for source_id, ids in self.source_ids.items()},
+        }
+
+    def save_local(self, folder_path: str, **manifest_fields):
+        """
+        Saves the FAISS index, the BM25 index and a manifest of the sources and their chunk ids in one folder.
+        Extra keyword arguments are added to the manifest.
+        """
+        os.makedirs(folder_path, exist_ok=True)
+        if self.vectors is not None:
+            self.vectors.save_local(folder_path)
+        with open(os.path.join(folder_path, "bm25.pkl"), "wb") as f:
+            pickle.dump(self.bm25, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(folder_path, "manifest.json"), "w") as f:
+            json.dump({**self.manifest(), **manifest_fields}, f)
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings: Embeddings) -> "DocumentStore":
+        """Opens a saved store, its indexes are read when first used"""
+        with open(os.path.join(folder_path, "manifest.json")) as f:
+            manifest = json.load(f)
+        store = cls(embeddings)
+        store.source_ids = {source_id: source["chunk_ids"] for source_id, source in manifest["sources"].items()}
+        store.source_names = {source_id: source["name"] for source_id, source in manifest["sources"].items()}
+        store._folder_path = folder_path
+        store._loaded = False
+        return store
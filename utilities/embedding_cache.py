@@ -0,0 +1,154 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, Callable
+
+from langchain.embeddings.base import Embeddings
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "embeddings.sqlite")
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# sqlite limits the number of host parameters in a single statement
+_SQL_BATCH = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed, on-disk cache in front of an embedding model.
+
+    Vectors are stored in a SQLite file keyed by hash(text + model name). When the stored vectors
+    grow beyond max_bytes the least recently used ones are evicted.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, path: str = DEFAULT_CACHE_PATH,
+                 max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # streamlit runs each session in its own thread, all of them share this connection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT TOTAL(size) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str, kind: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                self._conn.execute(
+                    f"UPDATE embeddings SET last_access = ? WHERE key IN ({placeholders})", [now, *batch]
+                )
+            self._conn.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            for key, vector in items.items():
+                blob = array("f", vector).tobytes()
+                old = self._conn.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, blob, len(blob), now),
+                )
+                self._total_bytes += len(blob) - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._total_bytes <= self.max_bytes:
+                break
+            evicted.append(key)
+            self._total_bytes -= size
+        for start in range(0, len(evicted), _SQL_BATCH):
+            batch = evicted[start:start + _SQL_BATCH]
+            self._conn.execute(f"DELETE FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+
+    def _embed_cached(self, texts: List[str], kind: str,
+                      embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        keys = [self._key(text, kind) for text in texts]
+        found = self._lookup(keys)
+
+        # embed every missing text once, even if it appears several times in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(keys) - sum(1 for key in keys if key in missing)
+        self.misses += sum(1 for key in keys if key in missing)
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self._store(new_items)
+            found.update(new_items)
+
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_cached(texts, "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_cached([text], "query", lambda batch: [self.embeddings.embed_query(batch[0])])[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters of this process and the current size of the cache file"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": int(self._total_bytes),
+        }
+
+
+_caches: Dict[tuple, CachedEmbeddings] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cached_embeddings(make_embeddings: Callable[[], Embeddings], model_name: str, path: str = DEFAULT_CACHE_PATH,
+                          max_bytes: int = DEFAULT_CACHE_MAX_BYTES) -> CachedEmbeddings:
+    """
+    Return the process-wide cache for (path, model_name) so counters survive streamlit reruns.
+    make_embeddings is only called to create the cache, the embeddings client is not rebuilt on every call.
+    """
+    key = (os.path.abspath(path), model_name)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = CachedEmbeddings(make_embeddings(), model_name, path=path, max_bytes=max_bytes)
+        return _caches[key]
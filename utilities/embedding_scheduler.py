@@ -0,0 +1,135 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+
+DEFAULT_BATCH_SIZE = 16
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second, holding at most `capacity` tokens"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        # a request larger than the bucket would wait forever, let it through once the bucket is full
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingScheduler:
+    """
+    Sends embedding requests in batches of batch_size over a bounded thread pool.
+    Requests are rate limited with token buckets (requests and approximate tokens per minute) and failed
+    batches are retried with jittered exponential backoff. embed_fn can be any function that maps a list of
+    texts to a list of vectors, e.g. OpenAIEmbeddings.embed_documents or a local fake.
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_concurrency: int = 4, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._request_bucket = TokenBucket(requests_per_minute / 60.0) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding")
+
+        self._stats_lock = threading.Lock()
+        self.total_chunks = 0
+        self.total_seconds = 0.0
+        self.retries = 0
+        self.last_chunks_per_second = 0.0
+
+    @staticmethod
+    def _approximate_tokens(texts: List[str]) -> int:
+        # ~4 characters per token for english text, good enough for rate limiting
+        return sum(len(text) for text in texts) // 4 + 1
+
+    def _embed_batch(self, texts: List[str],
+                     embed_fn: Optional[Callable[[List[str]], List[List[float]]]] = None) -> List[List[float]]:
+        embed_fn = embed_fn or self.embed_fn
+        for attempt in range(self.max_retries + 1):
+            if self._request_bucket is not None:
+                self._request_bucket.acquire()
+            if self._token_bucket is not None:
+                self._token_bucket.acquire(self._approximate_tokens(texts))
+            try:
+                return embed_fn(texts)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                with self._stats_lock:
+                    self.retries += 1
+                # full jitter: sleep a random time up to the exponential backoff
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors = []
+        # map keeps the order of the batches
+        for batch_vectors in self._executor.map(self._embed_batch, batches):
+            vectors.extend(batch_vectors)
+
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.total_chunks += len(texts)
+            self.total_seconds += elapsed
+            if texts and elapsed > 0:
+                self.last_chunks_per_second = len(texts) / elapsed
+        return vectors
+
+    def embed_one(self, text: str, embed_fn: Optional[Callable[[str], List[float]]] = None) -> List[float]:
+        """
+        Embeds a single text in the calling thread, rate limited and retried like the batches, with embed_fn
+        (e.g. an embed_query) instead of the batch function when given
+        """
+        if embed_fn is None:
+            return self._embed_batch([text])[0]
+        return self._embed_batch([text], lambda texts: [embed_fn(texts[0])])[0]
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            return {
+                "chunks": self.total_chunks,
+                "seconds": round(self.total_seconds, 3),
+                "chunks_per_second": self.total_chunks / self.total_seconds if self.total_seconds else 0.0,
+                "last_chunks_per_second": self.last_chunks_per_second,
+                "retries": self.retries,
+            }
+
+
+class ScheduledEmbeddings(Embeddings):
+    """Embeddings whose requests go through an EmbeddingScheduler, queries included so they share its rate limits"""
+
+    def __init__(self, embeddings: Embeddings, scheduler: Optional[EmbeddingScheduler] = None):
+        self.embeddings = embeddings
+        self.scheduler = scheduler or EmbeddingScheduler(embeddings.embed_documents)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.scheduler.embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.scheduler.embed_one(text, self.embeddings.embed_query)
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+from utilities.chunking import CHUNKING_VERSION
+from utilities.document_store import DocumentStore
+
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vectors")
+
+
+class IndexStore:
+    """
+    Directory of saved DocumentStores, one folder per (corpus fingerprint, embedding model, chunking version).
+
+    Folders are written to a temporary directory first and renamed into place, so a crash never leaves a
+    half-written index behind. Each folder has a manifest of the files and chunks it contains. When more than
+    max_corpora are saved, the least recently saved ones are removed, except those of the fingerprints returned
+    by in_use: a store opened from a folder reads its indexes only when first used, so the folders of the
+    corpora that sessions still hold (see CorpusRegistry) must stay.
+    """
+
+    def __init__(self, root: str = DEFAULT_INDEX_DIR, max_corpora: int = 20,
+                 in_use: Optional[Callable[[], Iterable[str]]] = None):
+        self.root = root
+        self.max_corpora = max_corpora
+        self.in_use = in_use
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(fingerprint: str, embedding_model: str) -> str:
+        key = f"{embedding_model}\0{fingerprint}\0{CHUNKING_VERSION}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    def path(self, fingerprint: str, embedding_model: str) -> str:
+        return os.path.join(self.root, self.key(fingerprint, embedding_model))
+
+    def exists(self, fingerprint: str, embedding_model: str) -> bool:
+        return os.path.exists(os.path.join(self.path(fingerprint, embedding_model), "manifest.json"))
+
+    def load(self, fingerprint: str, embedding_model: str, embeddings: Embeddings) -> Optional[DocumentStore]:
+        """Opens the saved store of a corpus, or returns None. Its indexes are only read when first used."""
+        if not self.exists(fingerprint, embedding_model):
+            return None
+        return DocumentStore.load_local(self.path(fingerprint, embedding_model), embeddings)
+
+    def save(self, store: DocumentStore, embedding_model: str):
+        final_path = self.path(store.fingerprint, embedding_model)
+        tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        try:
+            store.save_local(tmp_path, embedding_model=embedding_model, chunking=CHUNKING_VERSION, saved_at=time.time())
+            with self._lock:
+                old_path = None
+                if os.path.exists(final_path):
+                    old_path = tempfile.mkdtemp(prefix=".old-", dir=self.root)
+                    os.replace(final_path, os.path.join(old_path, "index"))
+                os.replace(tmp_path, final_path)
+            if old_path is not None:
+                shutil.rmtree(old_path, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self._prune()
+
+    def manifests(self) -> List[Dict]:
+        """Manifests of the saved corpora, most recently saved first"""
+        manifests = []
+        for name in os.listdir(self.root):
+            manifest_path = os.path.join(self.root, name, "manifest.json")
+            if name.startswith(".") or not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path) as f:
+                manifests.append({"key": name, **json.load(f)})
+        return sorted(manifests, key=lambda manifest: manifest.get("saved_at", 0), reverse=True)
+
+    def _prune(self):
+        in_use = set(self.in_use()) if self.in_use is not None else set()
+        with self._lock:
+            for manifest in self.manifests()[self.max_corpora:]:
+                if manifest.get("fingerprint") in in_use:
+                    continue
+                shutil.rmtree(os.path.join(self.root, manifest["key"]), ignore_errors=True)
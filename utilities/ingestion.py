@@ -0,0 +1,85 @@
+import os
+import hashlib
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from langchain.embeddings.base import Embeddings
+from pandas import DataFrame
+
+from utilities.csv_engine import CsvEngine
+from utilities.csv_loader import estimate_memory, load_csv, spill_to_parquet, stream_to_parquet
+from utilities.csv_profile import profile_dataframe, profile_parquet
+from utilities.document_store import DocumentStore
+from utilities.index_store import IndexStore
+from utilities.pdf_processing import get_source_name, iter_pdf_chunks
+
+
+# csv files larger than this (after loading with compact dtypes) are scanned from parquet files on disk
+CSV_SPILL_BYTES = int(os.environ.get("CSV_SPILL_BYTES", 256 * 1024 * 1024))
+CSV_SPILL_DIR = os.path.join(tempfile.gettempdir(), "chat_with_your_docs_csv")
+
+
+def file_hash(document: Any) -> str:
+    """Content hash of an uploaded file or of a file on disk"""
+    if hasattr(document, "getvalue"):
+        return hashlib.sha256(document.getvalue()).hexdigest()
+    with open(document, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def sync_pdf_store(store: DocumentStore, pdf_docs: List[Any]):
+    """
+    Embeds only the pdf files that are new to the store and removes the ones that are gone.
+    """
+    current = {file_hash(document): document for document in pdf_docs}
+    for source_id in set(store.sources) - set(current):
+        store.remove(source_id)
+    for source_id, document in current.items():
+        if source_id not in store.source_ids:
+            # pages are extracted in parallel and embedded in bounded batches
+            store.add_batches(source_id, iter_pdf_chunks(document), name=get_source_name(document))
+
+
+def load_pdf_store(pdf_docs: List[Any], embedding_model: str, embeddings: Embeddings, index_store: IndexStore,
+                   nearest_store: Optional[Callable[[Set[str]], Optional[DocumentStore]]] = None) -> DocumentStore:
+    """
+    Returns the saved index of the pdf files if one exists (nothing is parsed or embedded). Else the index is
+    derived from a copy of the store returned by nearest_store for the files' hashes, e.g. the nearest index
+    shared by other sessions, or built from scratch: only the files it lacks are parsed and embedded and the
+    ones it has in excess are removed. The index is saved for later sessions and restarts.
+    """
+    hashes = {file_hash(document) for document in pdf_docs}
+    store = index_store.load(DocumentStore.fingerprint_of(hashes), embedding_model, embeddings)
+    if store is None:
+        # a shared index is read-only, it is copied and the copy is changed
+        base = nearest_store(hashes) if nearest_store is not None else None
+        store = base.clone() if base is not None else DocumentStore(embeddings)
+        sync_pdf_store(store, pdf_docs)
+        index_store.save(store, embedding_model)
+    return store
+
+
+def load_csv_file(csv_file: Any, fingerprint: str, spill_bytes: int = CSV_SPILL_BYTES,
+                  spill_dir: str = CSV_SPILL_DIR) -> Tuple[Optional[DataFrame], Dict[str, Any], Optional[str], str]:
+    """
+    Loads a csv file with compact dtypes and profiles it. Returns the dataframe, a report of its size, the path of
+    its parquet file and its profile. Tables estimated larger than spill_bytes are streamed to parquet without
+    being loaded, and only the path is kept.
+    """
+    if estimate_memory(csv_file) > spill_bytes:
+        parquet_path, report = stream_to_parquet(csv_file, spill_dir, fingerprint)
+        return None, report, parquet_path, profile_parquet(parquet_path)
+    df, report = load_csv(csv_file)
+    profile = profile_dataframe(df)
+    if report["bytes_after"] > spill_bytes:
+        return None, report, spill_to_parquet(df, spill_dir, fingerprint), profile
+    return df, report, None, profile
+
+
+def register_csv_file(engine: CsvEngine, file_name: str, loaded: Tuple[Optional[DataFrame], Dict[str, Any],
+                      Optional[str], str], fingerprint: str) -> str:
+    """Registers a table returned by load_csv_file in the engine, returns its name"""
+    df, _, parquet_path, profile = loaded
+    if parquet_path:
+        return engine.register_parquet(file_name, parquet_path, fingerprint, profile=profile)
+    return engine.register(file_name, df, profile=profile, fingerprint=fingerprint)
@@ -0,0 +1,157 @@
+import io
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from PyPDF2 import PdfReader
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from utilities.chunking import BoilerplateStripper, SimHashIndex, strip_extraction_noise
+from utilities.tokens import count_tokens
+from utilities.tracing import traced
+
+
+PAGES_PER_TASK = 16
+CHUNK_BATCH_SIZE = 256
+# chunk sizes in tokens of the embedding model's tokenizer (cl100k_base for text-embedding-ada-002)
+CHUNK_TOKENS = 256
+# the splitter cuts at paragraphs, lines and sentences, a short overlap is enough to keep a cut sentence's context.
+# On data/AlMahamid_2022.pdf, 32 tokens of overlap embedded 7% more tokens than the former 250-character chunks.
+CHUNK_OVERLAP_TOKENS = 16
+# chunks shorter than this, e.g. a lone page number, carry nothing worth embedding
+MIN_CHUNK_TOKENS = 5
+
+# set in every worker process by _init_worker, so the pdf is sent and parsed once per worker
+_worker_reader = None
+
+
+def _init_worker(pdf_bytes: bytes):
+    global _worker_reader
+    _worker_reader = PdfReader(io.BytesIO(pdf_bytes))
+
+
+def _extract_pages(reader: PdfReader, start: int, stop: int) -> List[Tuple[int, str]]:
+    return [(number + 1, reader.pages[number].extract_text() or "") for number in range(start, stop)]
+
+
+def _extract_page_range(start: int, stop: int) -> List[Tuple[int, str]]:
+    return _extract_pages(_worker_reader, start, stop)
+
+
+def _read_bytes(pdf_doc: Any) -> bytes:
+    if hasattr(pdf_doc, "getvalue"):
+        return pdf_doc.getvalue()
+    with open(pdf_doc, "rb") as f:
+        return f.read()
+
+
+def get_source_name(pdf_doc: Any) -> str:
+    return getattr(pdf_doc, "name", None) or os.path.basename(str(pdf_doc))
+
+
+@traced("get_pdf_text")
+def get_pdf_text(pdf_doc: Any, max_workers: int = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Yields the text of each page with its metadata, in page order.
+    Pages are extracted in a process pool with a bounded number of page ranges in flight.
+    """
+    pdf_bytes = _read_bytes(pdf_doc)
+    source = get_source_name(pdf_doc)
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    num_pages = len(reader.pages)
+    page_ranges = [(start, min(start + PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, PAGES_PER_TASK)]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(page_ranges))
+
+    if max_workers <= 1:
+        pages = (page for start, stop in page_ranges for page in _extract_pages(reader, start, stop))
+        for page_number, text in pages:
+            yield text, {"source": source, "page": page_number}
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(pdf_bytes,)) as executor:
+        remaining = iter(page_ranges)
+        pending = deque()
+        for start, stop in itertools.islice(remaining, 2 * max_workers):
+            pending.append(executor.submit(_extract_page_range, start, stop))
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(remaining, None)
+            if next_range is not None:
+                pending.append(executor.submit(_extract_page_range, *next_range))
+            for page_number, text in pages:
+                yield text, {"source": source, "page": page_number}
+
+
+@traced("get_document_chunks")
+def get_document_chunks(text: str, metadata: Dict, chunk_tokens: int = CHUNK_TOKENS,
+                        chunk_overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Document]:
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens, chunk_overlap=chunk_overlap_tokens, length_function=count_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+    chunks = text_splitter.split_text(text)
+    docs = []
+    for chunk in chunks:
+        if count_tokens(chunk) < MIN_CHUNK_TOKENS:
+            continue
+        # Generate documents
+        docs.append(Document(page_content=chunk, metadata=dict(metadata)))
+    return docs
+
+
+def iter_pdf_chunks(pdf_doc: Any, batch_size: int = CHUNK_BATCH_SIZE, max_workers: int = None,
+                    strip_boilerplate: bool = True, deduplicate: bool = True,
+                    stats: Optional[Dict[str, int]] = None) -> Iterator[List[Document]]:
+    """
+    Streams the chunks of a pdf in batches of at most batch_size documents, each chunk keeps its page number.
+    Extraction noise (control characters, lines of garbled equations), running headers and footers are removed
+    from the pages and near-duplicate chunks of the pdf are dropped, so they are not embedded. Counts of pages,
+    chunks, tokens and removed text are added to stats if given.
+    """
+    stats = stats if stats is not None else {}
+    for key in ["pages", "chunks", "tokens", "noise_lines", "boilerplate_lines", "duplicate_chunks"]:
+        stats.setdefault(key, 0)
+    # the same stats can be passed for several pdfs
+    boilerplate_lines, duplicate_chunks = stats["boilerplate_lines"], stats["duplicate_chunks"]
+    stripper = BoilerplateStripper()
+    seen = SimHashIndex()
+
+    pages = get_pdf_text(pdf_doc, max_workers=max_workers)
+    if strip_boilerplate:
+        pages = _strip_noise(pages, stats)
+        pages = stripper.strip_pages(pages)
+
+    batch = []
+    for text, metadata in pages:
+        stats["pages"] += 1
+        for doc in get_document_chunks(text, metadata):
+            if deduplicate and not seen.add(doc.page_content):
+                continue
+            stats["chunks"] += 1
+            stats["tokens"] += count_tokens(doc.page_content)
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        stats["boilerplate_lines"] = boilerplate_lines + stripper.removed_lines
+        stats["duplicate_chunks"] = duplicate_chunks + seen.duplicates
+    if batch:
+        yield batch
+
+
+def _strip_noise(pages: Iterator[Tuple[str, Dict]], stats: Dict[str, int]) -> Iterator[Tuple[str, Dict]]:
+    for text, metadata in pages:
+        text, removed = strip_extraction_noise(text)
+        stats["noise_lines"] += removed
+        yield text, metadata
+
+
+def prepare_pdf_chunks(pdf_docs: List[Any], stats: Optional[Dict[str, int]] = None) -> List[Document]:
+    doc_chunks = []
+    for document in pdf_docs:
+        for batch in iter_pdf_chunks(document, stats=stats):
+            doc_chunks.extend(batch)
+    return doc_chunks
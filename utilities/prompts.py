@@ -1,5 +1,3 @@
-from langchain.prompts import PromptTemplate
-
 WELCOME_MESSAGE = """
 Hello and welcome! \U0001F44B
 
@@ -95,11 +93,16 @@ CSV_PROMPT_PREFIX = """
 First set the pandas display options to show all the columns, get the column names, then answer the question.
 """
 
+CSV_PROFILE_PROMPT_PREFIX = """
+This is a profile of the dataframe `df` ({num_rows} rows) with the dtype, null count, min/max/mean or most frequent values of each column:
+{profile}
+
+If the profile already answers the question, answer from it without running code. Otherwise use it instead of inspecting the dataframe and go straight to the code that answers the question.
+"""
+
 CSV_PROMPT_SUFFIX = """
-- **ALWAYS** before giving the Final Answer, try another method. Then reflect on the answers of the two methods you did and ask yourself if it answers correctly the original question. If you are not sure, try another method.
-- 
-- If the methods tried do not give the same result, reflect and try again until you have two methods that have the same result. 
-- If you still cannot arrive to a consistent result, say that you are not sure of the answer.
+- When the profile or a single run of code answers the question, give the Final Answer right away, do not run the calculation again.
+- Only if a result looks wrong (an error, an empty result, values outside the ranges in the profile), try another method. If you still cannot arrive to a consistent result, say that you are not sure of the answer.
 - If you are sure of the correct answer, create a beautiful and thorough response using Markdown.
 - If you need to run a code, to run the code use `python_repl_ast` with {'query': "created code here"}.
 - **ALWAYS** Use different color for each if there are more than one columns to plot. For example if you are plotting x1 and x2 columns, use blue for x1 and red for x2.
@@ -109,14 +112,46 @@ CSV_PROMPT_SUFFIX = """
 - **ALWAYS** run the code use `python_repl_ast` with {'query': "created code here"}.
 """
 
+CSV_SQL_PROMPT_PREFIX = """
+You are an assistant that answers questions about the uploaded csv files. Each csv file is a table in a DuckDB database:
+
+{schema}
+
+## On querying the tables:
+- Use `sql_db_query` to run a DuckDB SQL query and see its result. Quote table and column names with double quotes.
+- Let the database do the work: filter, join and aggregate in SQL instead of selecting whole tables.
+- The description of a table can include a profile of its columns (null counts, min/max/mean, most frequent values). If the profile already answers the question, answer from it without running a query.
+- The questions can be about one table or several tables, join them when the question needs it.
+- If a query returns an error, fix the query and try again.
+- **DO NOT MAKE UP AN ANSWER OR USE PRIOR KNOWLEDGE, ONLY USE THE RESULTS OF THE QUERIES YOU HAVE RUN**.
+
+## You have access to the following tools:
+"""
+
+CSV_SQL_PROMPT_SUFFIX = """
+- When the profile or a single query answers the question, give the Final Answer right away, do not run a second query to check it.
+- Only if a result looks wrong (an error, an empty result, values outside the ranges in the profile), fix the query and run it again. If you still cannot arrive to a consistent result, say that you are not sure of the answer.
+- If you are sure of the correct answer, create a beautiful and thorough response using Markdown.
+- **ALWAYS**, as part of your "Final Answer", explain how you got to the answer on a section that starts with: "\n\nExplanation:\n". In the explanation, mention the table and column names that you used to get to the final answer.
+- **NEVER** return a sql query as output.
+"""
+
 CHATGPT_PROMPT_TEMPLATE = CUSTOM_CHATBOT_PREFIX + """
 Human: {human_input}
 AI:"""
 
-CHATGPT_PROMPT = PromptTemplate(
-    input_variables=["human_input"],
-    template=CHATGPT_PROMPT_TEMPLATE
-)
+
+def __getattr__(name):
+    # the PromptTemplate is built on first use, importing langchain is too slow for the app's first page load
+    if name == "CHATGPT_PROMPT":
+        from langchain.prompts import PromptTemplate
+        global CHATGPT_PROMPT
+        CHATGPT_PROMPT = PromptTemplate(
+            input_variables=["human_input"],
+            template=CHATGPT_PROMPT_TEMPLATE
+        )
+        return CHATGPT_PROMPT
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 PDFSEARCH_PROMPT_PREFIX = CUSTOM_CHATBOT_PREFIX + """
@@ -0,0 +1,64 @@
+import re
+from typing import List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import BaseMemory
+from langchain.tools import BaseTool
+
+from utilities.tracing import traced
+
+
+_TOOL_TAG_PATTERN = re.compile(r"@\w+")
+
+
+def route_question(question: str, tools: List[BaseTool]) -> Optional[BaseTool]:
+    """The tool a question is tagged for (e.g. @pdfsearch), None if it names no tool, several or an unknown one"""
+    tags = {tag.lower() for tag in _TOOL_TAG_PATTERN.findall(question)}
+    if len(tags) != 1:
+        return None
+    tag = tags.pop()
+    return next((tool for tool in tools if tool.name.lower() == tag), None)
+
+
+def strip_tool_tag(question: str, tool: BaseTool) -> str:
+    """The question without the tag of its tool, which is only meaningful to the main agent"""
+    stripped = re.sub(rf"{re.escape(tool.name)}[\s,:]*", "", question, flags=re.IGNORECASE).strip()
+    return stripped or question
+
+
+def _save_answer(memory: Optional[BaseMemory], question: str, answer: str):
+    # the main agent sees routed questions in its history like the ones it answered itself
+    if memory is not None:
+        memory.save_context({"input": question}, {"output": answer})
+
+
+@traced("run_routed")
+def run_routed(question: str, tools: List[BaseTool], memory: Optional[BaseMemory] = None,
+               callbacks: Optional[List[BaseCallbackHandler]] = None) -> Optional[str]:
+    """
+    Answers a question tagged with one tool with that tool's sub-agent directly, skipping the main agent's turn
+    to pick the tool and its turn to rephrase the tool's answer. Returns None when the question is not routed
+    or the tool failed, the main agent should answer it then.
+    """
+    tool = route_question(question, tools)
+    if tool is None:
+        return None
+    answer = tool.run(strip_tool_tag(question, tool), callbacks=callbacks)
+    if answer is None:
+        return None
+    _save_answer(memory, question, answer)
+    return answer
+
+
+@traced("arun_routed")
+async def arun_routed(question: str, tools: List[BaseTool], memory: Optional[BaseMemory] = None,
+                      callbacks: Optional[List[BaseCallbackHandler]] = None) -> Optional[str]:
+    """Async run_routed"""
+    tool = route_question(question, tools)
+    if tool is None:
+        return None
+    answer = await tool.arun(strip_tool_tag(question, tool), callbacks=callbacks)
+    if answer is None:
+        return None
+    _save_answer(memory, question, answer)
+    return answer
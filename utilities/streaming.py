@@ -0,0 +1,115 @@
+import json
+from typing import Any, Dict, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+FINAL_ANSWER_MARKER = '"action": "Final Answer"'
+ACTION_INPUT_MARKER = '"action_input": "'
+# the ZERO_SHOT sub-agents end with plain text after this marker
+REACT_FINAL_ANSWER_MARKER = "Final Answer:"
+
+
+class StreamlitStreamHandler(BaseCallbackHandler):
+    """
+    Streams the final answer of the main conversational agent into a streamlit placeholder token by token.
+
+    The main agent replies with a json blob, tokens are only shown once the blob is known to be the
+    "Final Answer" and only the (unescaped) action_input string is shown. Tokens of the sub-agents running
+    inside the tools are not shown, instead the tool being run is written to a status placeholder.
+
+    When a question is routed straight to a tool (see utilities.router), answer_depth=1 streams the
+    "Final Answer:" of that tool's sub-agent instead.
+    """
+
+    def __init__(self, answer_placeholder: Any, status_placeholder: Optional[Any] = None, answer_depth: int = 0):
+        self.answer_placeholder = answer_placeholder
+        self.status_placeholder = status_placeholder
+        self.answer_depth = answer_depth
+        self.answer = ""
+        self._tool_depth = 0
+        self._buffer = ""
+        self._streaming = False
+        self._escaped = False
+        self._done = False
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, **kwargs: Any) -> None:
+        if self._tool_depth == self.answer_depth:
+            self.answer = ""
+            self._buffer = ""
+            self._streaming = False
+            self._escaped = False
+            self._done = False
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, **kwargs: Any) -> None:
+        self.on_llm_start(serialized, messages, **kwargs)
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self._tool_depth != self.answer_depth or self._done:
+            return
+
+        if self.answer_depth > 0:
+            self._append_react(token)
+            return
+
+        if not self._streaming:
+            self._buffer += token
+            if FINAL_ANSWER_MARKER not in " ".join(self._buffer.split()) or ACTION_INPUT_MARKER not in self._buffer:
+                return
+            self._streaming = True
+            # keep whatever came after the opening quote of action_input in the same token
+            token = self._buffer.split(ACTION_INPUT_MARKER, 1)[1]
+
+        self._append(token)
+
+    def _append_react(self, token: str):
+        if not self._streaming:
+            self._buffer += token
+            if REACT_FINAL_ANSWER_MARKER not in self._buffer:
+                return
+            self._streaming = True
+            token = self._buffer.split(REACT_FINAL_ANSWER_MARKER, 1)[1].lstrip()
+
+        if token:
+            self.answer += token
+            self.answer_placeholder.markdown(self.answer + "▌")
+
+    def _append(self, token: str):
+        text = ""
+        for char in token:
+            if self._escaped:
+                self._escaped = False
+                # json escapes such as \n, \" and \\
+                try:
+                    text += json.loads(f'"\\{char}"')
+                except ValueError:
+                    text += char
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._done = True
+                break
+            else:
+                text += char
+
+        if text:
+            self.answer += text
+            self.answer_placeholder.markdown(self.answer + "▌")
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self._tool_depth += 1
+        if self.status_placeholder is not None and self._tool_depth == self.answer_depth + 1:
+            self.status_placeholder.info(f"Running {serialized.get('name', 'tool')}: {input_str}")
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        self._tool_depth = max(0, self._tool_depth - 1)
+        if self.status_placeholder is not None and self._tool_depth == self.answer_depth:
+            self.status_placeholder.info("Writing the answer...")
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._tool_depth = max(0, self._tool_depth - 1)
+
+    def clear(self):
+        self.answer_placeholder.empty()
+        if self.status_placeholder is not None:
+            self.status_placeholder.empty()
@@ -0,0 +1,46 @@
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
+
+# tokenizer of the gpt-35-turbo and gpt-4 deployments
+ENCODING_NAME = "cl100k_base"
+# rough size of a token of english text, used when the tokenizer is not available
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> Optional["tiktoken.Encoding"]:
+    """
+    The tokenizer, or None if it cannot be loaded. tiktoken downloads its encoding files on first use, without
+    network access this fails, once: the failure is cached and tokens are estimated from characters instead.
+    """
+    if not HAS_TIKTOKEN:
+        return None
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The first max_tokens tokens of text"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
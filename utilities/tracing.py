@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+
+DEFAULT_TRACE_PATH = os.environ.get(
+    "TRACE_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "traces", "traces.jsonl")
+)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span_id = contextvars.ContextVar("current_span_id", default=None)
+
+
+class Trace:
+    """Spans, LLM calls and token counts of one request (a question, an ingestion, ...)"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.spans: List[Dict[str, Any]] = []
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def summary(self) -> Dict[str, Any]:
+        """Duration of the request, LLM usage and the total time spent in each kind of span"""
+        totals = {}
+        for span in self.spans:
+            total = totals.setdefault(span["name"], {"count": 0, "seconds": 0.0})
+            total["count"] += 1
+            total["seconds"] += span["duration_ms"] / 1000
+        end_ns = self.end_ns or time.time_ns()
+        return {
+            "type": "request",
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "duration_s": (end_ns - self.start_ns) / 1e9,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "spans": totals,
+        }
+
+
+class Tracer:
+    """
+    Records timed spans, nested through context variables, and exports them as OpenTelemetry-like JSONL records:
+    one line per span followed by a summary line per request. Spans outside a request are exported on their own.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_TRACE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def request(self, name: str, **attributes: Any):
+        trace = Trace(name, attributes)
+        token = _current_trace.set(trace)
+        try:
+            with self.span(name, **attributes):
+                yield trace
+        finally:
+            _current_trace.reset(token)
+            trace.end_ns = time.time_ns()
+            self._export(trace.spans + [trace.summary()])
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any):
+        span_id = uuid4().hex[:16]
+        parent_span_id = _current_span_id.get()
+        start_ns = time.time_ns()
+        token = _current_span_id.set(span_id)
+        status = "ok"
+        try:
+            yield span_id
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            _current_span_id.reset(token)
+            self.record(name, start_ns, time.time_ns(), span_id=span_id, parent_span_id=parent_span_id,
+                        status=status, **attributes)
+
+    def record(self, name: str, start_ns: int, end_ns: int, span_id: Optional[str] = None,
+               parent_span_id: Optional[str] = None, trace: Optional[Trace] = None, status: str = "ok",
+               **attributes: Any):
+        trace = trace or _current_trace.get()
+        span = {
+            "type": "span",
+            "trace_id": trace.trace_id if trace is not None else uuid4().hex,
+            "span_id": span_id or uuid4().hex[:16],
+            "parent_span_id": parent_span_id,
+            "name": name,
+            "start_time_unix_nano": start_ns,
+            "end_time_unix_nano": end_ns,
+            "duration_ms": (end_ns - start_ns) / 1e6,
+            "status": status,
+            "attributes": attributes,
+        }
+        if trace is not None:
+            trace.spans.append(span)
+        else:
+            self._export([span])
+
+    def _export(self, records: List[Dict[str, Any]]):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(lines)
+
+
+tracer = Tracer()
+
+
+def traced(name: str):
+    """
+    Decorator recording a span for every call. For generator functions the span covers the time spent
+    producing the items, not the time the caller spends consuming them.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def coroutine_wrapper(*args, **kwargs):
+                with tracer.span(name):
+                    return await fn(*args, **kwargs)
+            return coroutine_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                trace, parent_span_id = _current_trace.get(), _current_span_id.get()
+                start_ns = time.time_ns()
+                busy_ns = 0
+                items = 0
+                generator = fn(*args, **kwargs)
+                try:
+                    while True:
+                        resumed_ns = time.perf_counter_ns()
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        finally:
+                            busy_ns += time.perf_counter_ns() - resumed_ns
+                        items += 1
+                        yield item
+                finally:
+                    generator.close()
+                    tracer.record(name, start_ns, start_ns + busy_ns, parent_span_id=parent_span_id, trace=trace,
+                                  items=items, wall_ms=(time.time_ns() - start_ns) / 1e6)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
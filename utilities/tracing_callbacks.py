@@ -0,0 +1,55 @@
+import time
+from typing import Any, Dict, List
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+
+from utilities.tracing import tracer, _current_trace, _current_span_id
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Records a span with duration and token counts for every LLM call and counts them in the current request"""
+
+    # async runs call sync handlers in an executor without their context, the current trace would be lost
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+
+    def _start(self, run_id: UUID, prompt_chars: int):
+        self._runs[run_id] = {"start_ns": time.time_ns(), "prompt_chars": prompt_chars, "streamed_tokens": 0,
+                              "trace": _current_trace.get(), "parent_span_id": _current_span_id.get()}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, sum(len(prompt) for prompt in prompts))
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            **kwargs: Any) -> None:
+        self._start(run_id, sum(len(str(message.content)) for batch in messages for message in batch))
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id in self._runs:
+            self._runs[run_id]["streamed_tokens"] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        # streamed responses come without usage, estimate it (~4 characters per token)
+        prompt_tokens = usage.get("prompt_tokens", run["prompt_chars"] // 4)
+        completion_tokens = usage.get("completion_tokens", run["streamed_tokens"])
+        trace = run["trace"]
+        if trace is not None:
+            trace.llm_calls += 1
+            trace.prompt_tokens += prompt_tokens
+            trace.completion_tokens += completion_tokens
+        tracer.record("llm", run["start_ns"], time.time_ns(), parent_span_id=run["parent_span_id"], trace=trace,
+                      prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, estimated=not usage)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            tracer.record("llm", run["start_ns"], time.time_ns(), parent_span_id=run["parent_span_id"],
+                          trace=run["trace"], status="error", error=str(error))